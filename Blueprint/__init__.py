@@ -1 +1,2 @@
 from .library import library
+from .api import api
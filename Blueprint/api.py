@@ -0,0 +1,113 @@
+from flask import Blueprint, current_app, jsonify, request
+import hashlib
+import json
+from services import fulltext
+from services.catalog import parse_composer_ids
+
+# Define Blueprint for the read-only JSON API
+api = Blueprint("api", __name__, url_prefix="/api")
+
+
+# Build a stable ETag from the catalog version and the normalised query
+def make_etag(*parts):
+    payload = json.dumps(parts, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+# Answer with 304 Not Modified if the client already has this ETag.
+# If-None-Match uses weak comparison, so a W/ prefix added by a proxy or
+# compression layer still matches. The 304 repeats the caching headers.
+def not_modified(etag):
+    if request.if_none_match.contains_weak(etag):
+        return cacheable(current_app.response_class(status=304), etag)
+    return None
+
+
+# Mark a JSON response as cacheable by clients and intermediaries
+def cacheable(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config["API_MAX_AGE"]
+    return response
+
+
+# Route returning works for the selected composers and genres
+@api.route("/works", methods=["GET"])
+def works():
+    composer_ids = parse_composer_ids(request.args.getlist("composer_id"))
+    genres = request.args.getlist("genre")
+
+    if not composer_ids:
+        return jsonify(error="No composer selected"), 400
+    if not genres:
+        return jsonify(error="No genres selected"), 400
+
+    # The ETag follows the catalog version the index is serving
+    work_index = current_app.extensions["work_index"]
+    version = work_index.version()
+    etag = make_etag("works", version, composer_ids, genres)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    composer_results = work_index.lookup(composer_ids, genres)
+    all_works = [
+        work.to_dict() for _, _, works in composer_results for work in works
+    ]
+
+    response = jsonify(
+        catalog_version=version,
+        composers=[
+            {"id": composer_id, "name": name}
+            for composer_id, name, _ in composer_results
+        ],
+        works=all_works,
+    )
+    return cacheable(response, etag)
+
+
+# Route for ranked full-text search over titles, subtitles and composers
+@api.route("/search", methods=["GET"])
+def search():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify(error="No search query given"), 400
+
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get(
+        "per_page", current_app.config["API_SEARCH_PAGE_SIZE"], type=int
+    )
+    # Pages past the cap come back empty rather than overflowing OFFSET
+    page = max(1, min(page, current_app.config["API_SEARCH_MAX_PAGE"]))
+    per_page = max(
+        1, min(per_page, current_app.config["API_SEARCH_MAX_PAGE_SIZE"])
+    )
+
+    version = current_app.extensions["work_index"].version()
+    etag = make_etag("search", version, query, page, per_page)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    total, results = fulltext.search(query, page=page, per_page=per_page)
+    response = jsonify(
+        query=query,
+        page=page,
+        per_page=per_page,
+        total=total,
+        works=results,
+    )
+    return cacheable(response, etag)
+
+
+# Route for composer autocomplete
+@api.route("/composers", methods=["GET"])
+def composers():
+    query = request.args.get("q", "")
+    limit = request.args.get(
+        "limit", current_app.config["API_COMPOSER_LIMIT"], type=int
+    )
+    limit = max(1, min(limit, current_app.config["API_COMPOSER_MAX_LIMIT"]))
+
+    matches = current_app.extensions["composer_index"].search(query, limit)
+    return jsonify(composers=matches)
@@ -1,23 +1,53 @@
 from flask import (
     Blueprint,
+    Response,
     render_template,
     redirect,
     url_for,
     request,
     current_app,
+    jsonify,
+    stream_with_context,
 )
-import google.generativeai as genai
+import json
+import os
 from database import db
-from models.musicpiece import MusicPiece
 from models.user import User
 from models.userlibrary import UserLibrary
+from services.descriptions import (
+    describe_piece,
+    model_label,
+    piece_description_prompt,
+    store_description,
+    stored_description,
+)
+from services.library import (
+    LIBRARY_SORTS,
+    add_to_library,
+    import_pieces,
+    library_page,
+    parse_import,
+    remove_from_library,
+)
+from services.llm import get_llm
 import traceback
 
 # Define Blueprint for the library
 library = Blueprint("library", __name__, url_prefix="/library")
 
+# Genres offered in the search and library forms
+GENRES = [
+    "Keyboard",
+    "Orchestral",
+    "Chamber",
+    "Stage",
+    "Choral",
+    "Opera",
+    "Vocal",
+]
 
-# Route to display user's music library
+
+# Route to display one page of a user's music library
 @library.route("/", methods=["GET"])
 def all_pieces():
     user_name = request.args.get("user_name")
@@ -27,23 +57,41 @@ def all_pieces():
             "library.html", pieces=[], username_missing=True
         )
 
-    user = User.query.filter_by(username=user_name).first()
-
-    if not user:
-        return render_template(
-            "library.html",
-            pieces=[],
-            username_missing=False,
-            user_name=user_name,
-        )
+    # Sorting, filters and the keyset cursor all come from the query string
+    filters = {
+        "sort": request.args.get("sort", "composer"),
+        "composer": request.args.get("composer", "").strip(),
+        "genre": request.args.get("genre", "").strip(),
+        "popular": request.args.get("popular") == "1",
+        "recommended": request.args.get("recommended") == "1",
+    }
+    if filters["sort"] not in LIBRARY_SORTS:
+        filters["sort"] = "composer"
+    page_size = request.args.get(
+        "page_size", current_app.config["LIBRARY_PAGE_SIZE"], type=int
+    )
+    page_size = max(
+        1, min(page_size, current_app.config["LIBRARY_MAX_PAGE_SIZE"])
+    )
 
-    user_pieces = [entry.music_piece for entry in user.library]
+    pieces, next_cursor = library_page(
+        user_name,
+        cursor=request.args.get("cursor"),
+        page_size=page_size,
+        **filters,
+    )
 
     return render_template(
         "library.html",
-        pieces=user_pieces,
+        pieces=pieces,
         username_missing=False,
         user_name=user_name,
+        filters=filters,
+        sorts=list(LIBRARY_SORTS),
+        genres=GENRES,
+        page_size=page_size,
+        next_cursor=next_cursor,
+        first_page=not request.args.get("cursor"),
     )
 
 
@@ -59,40 +107,11 @@ def add_piece():
     popular = request.form.get("popular") == "true"
     recommended = request.form.get("recommended") == "true"
 
-    # Find the user, or create new one if not found
-    user = User.query.filter_by(username=user_name).first()
-    if not user:
-        user = User(username=user_name)
-        db.session.add(user)
-        db.session.commit()
-
-    # Find the music piece, or create new one if not found
-    music_piece = MusicPiece.query.filter_by(
-        composer=composer, title=title, subtitle=subtitle
-    ).first()
-    if not music_piece:
-        music_piece = MusicPiece(
-            composer=composer,
-            title=title,
-            subtitle=subtitle,
-            genre=genre,
-            popular=popular,
-            recommended=recommended,
-        )
-        db.session.add(music_piece)
-        db.session.commit()
-
-    # Check if music piece is already in user's library, and add it if not
-    existing_entry = UserLibrary.query.filter_by(
-        user_id=user.id, music_piece_id=music_piece.id
-    ).first()
-    if not existing_entry:
-        user_library_entry = UserLibrary(
-            user_id=user.id, music_piece_id=music_piece.id
-        )
-        db.session.add(user_library_entry)
-        db.session.commit()
-    else:
+    # Create the user, piece and library entry as needed in one commit
+    added = add_to_library(
+        user_name, composer, title, subtitle, genre, popular, recommended
+    )
+    if not added:
         print(
             f"Music piece '{title}' by '{composer}' is already in the library."
         )
@@ -101,18 +120,50 @@ def add_piece():
     return redirect(url_for("library.all_pieces", user_name=user_name))
 
 
-# Function to delete music pieces not referenced by any user library
-def delete_orphaned_music_pieces():
-    orphaned_pieces = (
-        db.session.query(MusicPiece)
-        .outerjoin(UserLibrary, MusicPiece.id == UserLibrary.music_piece_id)
-        .filter(UserLibrary.music_piece_id == None)
-        .all()
+# Route to add several selected works at once. Takes JSON
+# {"user_name": ..., "pieces": [{composer, title, subtitle, genre,
+# popular, recommended}, ...]} and answers with JSON counts.
+@library.route("/add_pieces", methods=["POST"])
+def add_pieces():
+    data = request.get_json(silent=True) or {}
+    user_name = data.get("user_name")
+    pieces = data.get("pieces")
+    if (
+        not isinstance(user_name, str)
+        or not user_name
+        or not isinstance(pieces, list)
+    ):
+        return jsonify(error="user_name and pieces are required"), 400
+    if len(pieces) > current_app.config["LIBRARY_BATCH_ADD_MAX"]:
+        return jsonify(error="Too many pieces in one request"), 413
+
+    counts = import_pieces(
+        user_name, pieces, current_app.config["LIBRARY_IMPORT_CHUNK_SIZE"]
     )
+    return jsonify(user_name=user_name, **counts)
+
+
+# Route to import many pieces into a user's library from a CSV or JSON
+# file upload
+@library.route("/import", methods=["POST"])
+def import_library():
+    user_name = request.form.get("user_name")
+    upload = request.files.get("file")
+    if not user_name or upload is None:
+        return jsonify(error="user_name and file are required"), 400
 
-    for piece in orphaned_pieces:
-        db.session.delete(piece)
-    db.session.commit()
+    # The format defaults to the uploaded file's extension
+    extension = os.path.splitext(upload.filename or "")[1].lstrip(".")
+    fmt = request.form.get("format") or extension
+    try:
+        rows = parse_import(upload.read().decode("utf-8-sig"), fmt.lower())
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify(error=f"Could not read import: {e}"), 400
+
+    counts = import_pieces(
+        user_name, rows, current_app.config["LIBRARY_IMPORT_CHUNK_SIZE"]
+    )
+    return jsonify(user_name=user_name, **counts)
 
 
 # Route to view or remove a single music piece from a user's library
@@ -135,17 +186,29 @@ def single_piece(piece_id):
         request.method == "POST"
         and request.form.get("submit_button") == "delete"
     ):
+        # Unlink the piece, deleting it only if nobody else has it
         if user_library_entry:
-            db.session.delete(user_library_entry)
-            db.session.commit()
-            delete_orphaned_music_pieces()
+            remove_from_library(user.id, piece_id)
         return redirect(url_for("library.all_pieces", user_name=user_name))
 
-    # Generate AI description for the piece
     piece = user_library_entry.music_piece
-    print(f"Generating description for piece: {piece.title}")
+
+    # In streaming mode the page loads first and a description that isn't
+    # stored yet follows
+    if (
+        request.args.get("stream") == "1"
+        or current_app.config.get("LLM_STREAMING")
+    ) and stored_description(piece.id) is None:
+        return render_template(
+            "library_piece.html",
+            piece=piece,
+            ai_description=None,
+            stream_description=True,
+            user_name=user_name,
+        )
+
+    # Look up (or generate) the AI description for the piece
     ai_description = generate_piece_description(piece)
-    print(f"Generated description: {ai_description}")
 
     return render_template(
         "library_piece.html",
@@ -157,38 +220,12 @@ def single_piece(piece_id):
 
 def generate_piece_description(piece):
     try:
-        print("Starting description generation...")
-
-        # Access the API key
-        api_key = current_app.config["GOOGLE_API_KEY"]
-        if not api_key:
-            print("No Google API key found in config")
-            return "Unable to generate description: API key not configured"
-
-        # Configure Gemini AI
-        genai.configure(api_key=api_key)
-        print("Configured Gemini AI")
-
-        model = genai.GenerativeModel("gemini-pro")
-        print("Created model instance")
-
-        prompt = (
-            f"Generate a brief, engaging description (2-3 sentences) of the following classical music piece:\n"
-            f"Title: {piece.title}\n"
-            f"Composer: {piece.composer}\n"
-            f"Genre: {piece.genre}\n"
-            f"Additional info: {'This is a popular piece. ' if piece.popular else ''}"
-            f"{'This piece is highly recommended by critics. ' if piece.recommended else ''}\n"
-            "Focus on what makes this piece special and its historical or musical significance."
-        )
-        print(f"Using prompt: {prompt}")
-
-        response = model.generate_content(prompt)
-        description = response.text
-        print(f"Successfully generated description: {description}")
-        return description
+        # Served from the database unless the prompt has changed
+        return describe_piece(piece)
 
     except Exception as e:
+        # Leave the session usable for rendering the rest of the page
+        db.session.rollback()
         print(f"Error type: {type(e)}")
         print(f"Error message: {str(e)}")
         print("Full traceback:")
@@ -196,29 +233,50 @@ def generate_piece_description(piece):
         return f"Unable to generate description. Error: {str(e)}"
 
 
+# Route streaming a piece's AI description as Server-Sent Events
+@library.route("/<int:piece_id>/description/stream", methods=["GET"])
+def stream_piece_description(piece_id):
+    user_name = request.args.get("user_name")
+    user = User.query.filter_by(username=user_name).first()
+    if not user:
+        return "User not found", 404
+
+    user_library_entry = UserLibrary.query.filter_by(
+        user_id=user.id, music_piece_id=piece_id
+    ).first()
+    if not user_library_entry:
+        return "Piece not found", 404
+
+    piece = user_library_entry.music_piece
+    stored = stored_description(piece.id)
+    prompt = piece_description_prompt(piece)
+    llm = get_llm()
+
+    # Forward each chunk from the LLM as soon as it arrives, then save the
+    # full text; a stored description is sent as a single chunk
+    def events():
+        try:
+            if stored is not None:
+                yield f"event: chunk\ndata: {json.dumps({'text': stored})}\n\n"
+            else:
+                chunks = []
+                for text in llm.stream(prompt):
+                    chunks.append(text)
+                    yield f"event: chunk\ndata: {json.dumps({'text': text})}\n\n"
+                store_description(piece.id, "".join(chunks), model_label(llm))
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"Error streaming description: {e}")
+            yield f"event: failed\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 # Route to display the library form and handle composer and genre selection
 @library.route("/form", methods=["GET", "POST"])
 def library_form():
-    # Fetch the list of composers from the OpenOpus API
-    try:
-        response = request.get(
-            "https://api.openopus.org/composer/list/name/all.json"
-        )
-        composers = (
-            response.json()["composers"] if response.status_code == 200 else []
-        )
-    except Exception:
-        composers = []
-
-    # Define the list of genres
-    genres = [
-        "Keyboard",
-        "Orchestral",
-        "Chamber",
-        "Stage",
-        "Choral",
-        "Opera",
-        "Vocal",
-    ]
-
-    return render_template("form.html", composers=composers, genres=genres)
+    return render_template("form.html", genres=GENRES)
@@ -1,13 +1,128 @@
 import click
-from flask import Flask, render_template, request
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    render_template,
+    request,
+    session,
+    stream_template,
+)
 import requests
+from sqlalchemy.exc import SQLAlchemyError
 from database import db as database
+import atexit
+import json
 import os
+import tempfile
+import time
 from dotenv import load_dotenv
-import google.generativeai as genai
 import Blueprint as blueprints
-from cli import create_all, drop_all, populate
+from Blueprint.library import GENRES
+from cli import (
+    create_all,
+    drop_all,
+    gc_orphaned_pieces,
+    import_library,
+    invalidate_descriptions,
+    migrate,
+    populate,
+    pregenerate_descriptions,
+    rebuild_search_index,
+    sync_catalog,
+)
 from flask_session import Session
+from models.composer import Composer
+from services.cache import ResponseCache
+from services.catalog import (
+    composer_names as lookup_composer_names,
+    parse_composer_ids,
+)
+from services.http import HttpClient, redact
+from services.jobs import JobRunner
+from services.suggestions import (
+    cached_suggestion,
+    generate_suggestion,
+    suggestion_key,
+)
+from services.llm import create_gateway
+from services.typeahead import ComposerPrefixIndex
+from services.weather import normalise_location, weather_url
+from services.work_index import WorkIndex
+
+# Shared service settings
+SERVICE_CONFIG = {
+    # Concurrent outbound calls: pool size and /weather-mood deadline
+    "FANOUT_WORKERS": 16,
+    "WEATHER_MOOD_DEADLINE": 5,
+    # Weather location used until a visitor picks their own
+    "DEFAULT_WEATHER_LOCATION": "London",
+    # LLM gateway: backend ("gemini", or "stub" for offline runs), model,
+    # per-call timeout (seconds), worker threads and the stub's latency
+    "LLM_BACKEND": "gemini",
+    "LLM_MODEL": "gemini-pro",
+    "LLM_TIMEOUT": 30,
+    "LLM_WORKERS": 8,
+    "LLM_STUB_LATENCY": 0,
+    # Shared LLM rate limit (requests per minute, burst size) and how long
+    # a call may queue for it before giving up (seconds)
+    "LLM_RPM": 60,
+    "LLM_BURST": 10,
+    "LLM_QUEUE_TIMEOUT": 30,
+    # Stream LLM output to the browser as it is generated
+    "LLM_STREAMING": False,
+    # Background jobs: workers, how long finished jobs are kept and how
+    # long one SSE connection may stay open (seconds)
+    "JOB_WORKERS": 4,
+    "JOB_MAX_AGE": 10 * 60,
+    "JOB_EVENTS_TIMEOUT": 15,
+    # Push weather-mood suggestions with Server-Sent Events instead of
+    # polling. Each open stream holds a worker, so only enable this when
+    # serving with async workers (e.g. gunicorn -k gevent).
+    "SUGGESTION_SSE": False,
+    # Outbound HTTP connection pool, timeouts (seconds) and retries
+    "HTTP_POOL_SIZE": 10,
+    "HTTP_CONNECT_TIMEOUT": 3.05,
+    "HTTP_READ_TIMEOUT": 10,
+    "HTTP_RETRIES": 3,
+    "HTTP_BACKOFF_FACTOR": 0.3,
+    # Library listing page size
+    "LIBRARY_PAGE_SIZE": 50,
+    "LIBRARY_MAX_PAGE_SIZE": 200,
+    # Rows written per batch by the bulk library import, and the most
+    # pieces one multi-select add may carry
+    "LIBRARY_IMPORT_CHUNK_SIZE": 500,
+    "LIBRARY_BATCH_ADD_MAX": 1000,
+    # /search pagination
+    "SEARCH_PAGE_SIZE": 200,
+    "SEARCH_MAX_PAGE_SIZE": 1000,
+    # Cache lifetime (seconds) and page sizes for the JSON API
+    "API_MAX_AGE": 300,
+    "API_SEARCH_PAGE_SIZE": 20,
+    "API_SEARCH_MAX_PAGE_SIZE": 100,
+    "API_SEARCH_MAX_PAGE": 1000,
+    "API_COMPOSER_LIMIT": 10,
+    "API_COMPOSER_MAX_LIMIT": 50,
+    # Weather-mood suggestion cache: TTL (seconds), variants kept per key
+    # and the width of a temperature bucket (°C)
+    "SUGGESTION_CACHE_TTL": 3 * 60 * 60,
+    "SUGGESTION_VARIANTS_PER_KEY": 3,
+    "SUGGESTION_TEMP_BUCKET": 5,
+    # In-memory work index budget
+    "WORK_INDEX_MAX_BYTES": 64 * 1024 * 1024,
+    # How often in-memory catalog indexes check for a newer sync
+    "CATALOG_REFRESH_SECONDS": 60,
+    # Outbound API cache (TTLs in seconds, keyed by URL prefix). Expired
+    # entries are served while they refresh, for at most MAX_STALE seconds.
+    "API_CACHE_MAX_ENTRIES": 512,
+    "API_CACHE_DEFAULT_TTL": 300,
+    "API_CACHE_MAX_STALE": 60 * 60,
+    "API_CACHE_TTLS": {
+        "https://api.openopus.org/": 24 * 60 * 60,
+        "http://api.weatherapi.com/": 15 * 60,
+    },
+}
 
 
 def create_app(testing=False):
@@ -17,19 +132,30 @@ def create_app(testing=False):
     )
 
     if testing:
+        # Use a throwaway database file rather than :memory:, whose single
+        # shared connection can't be used by background job threads
+        db_fd, db_path = tempfile.mkstemp(prefix="mystro-test-", suffix=".db")
+        os.close(db_fd)
+        atexit.register(os.remove, db_path)
+
         # Set up test configuration
         app.config.update(
             {
                 "TESTING": True,
                 "SECRET_KEY": "test_key",
-                "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
                 "SQLALCHEMY_TRACK_MODIFICATIONS": False,
                 "WEATHER_API_KEY": "test_key",
                 "GOOGLE_API_KEY": "test_key",
+                **SERVICE_CONFIG,
             }
         )
         database.init_app(app)
+        with app.app_context():
+            database.create_all()
+        init_services(app)
         app.register_blueprint(blueprints.library)
+        app.register_blueprint(blueprints.api)
         register_routes(app)
         return app
 
@@ -42,26 +168,105 @@ def create_app(testing=False):
             "WEATHER_API_KEY": os.getenv("WEATHER_API_KEY"),
             "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY"),
             "SESSION_TYPE": "filesystem",
+            **SERVICE_CONFIG,
+            "LLM_BACKEND": os.getenv(
+                "LLM_BACKEND", SERVICE_CONFIG["LLM_BACKEND"]
+            ),
+            "SUGGESTION_SSE": os.getenv("SUGGESTION_SSE") == "1",
         }
     )
 
-    genai.configure(api_key=app.config["GOOGLE_API_KEY"])
     Session(app)
     database.init_app(app)
+    init_services(app)
     app.register_blueprint(blueprints.library)
+    app.register_blueprint(blueprints.api)
 
     # Register CLI commands
     with app.app_context():
         app.cli.add_command(create_all)
         app.cli.add_command(drop_all)
         app.cli.add_command(populate)
+        app.cli.add_command(sync_catalog)
+        app.cli.add_command(rebuild_search_index)
+        app.cli.add_command(invalidate_descriptions)
+        app.cli.add_command(pregenerate_descriptions)
+        app.cli.add_command(import_library)
+        app.cli.add_command(gc_orphaned_pieces)
+        app.cli.add_command(migrate)
         click.echo("CLI commands registered")
 
     register_routes(app)
     return app
 
 
+def init_services(app):
+    # Thread pool for running independent outbound calls side by side
+    app.extensions["fanout"] = ThreadPoolExecutor(
+        max_workers=app.config["FANOUT_WORKERS"],
+        thread_name_prefix="fanout",
+    )
+
+    # Background jobs for slow work such as LLM calls
+    app.extensions["jobs"] = JobRunner(
+        app,
+        max_workers=app.config["JOB_WORKERS"],
+        max_age=app.config["JOB_MAX_AGE"],
+    )
+
+    # Pooled HTTP client used for every outbound call
+    app.extensions["http"] = HttpClient(
+        pool_size=app.config["HTTP_POOL_SIZE"],
+        connect_timeout=app.config["HTTP_CONNECT_TIMEOUT"],
+        read_timeout=app.config["HTTP_READ_TIMEOUT"],
+        retries=app.config["HTTP_RETRIES"],
+        backoff_factor=app.config["HTTP_BACKOFF_FACTOR"],
+    )
+
+    # Shared cache for outbound API calls
+    app.extensions["api_cache"] = ResponseCache(
+        app.extensions["http"].get_json,
+        max_entries=app.config["API_CACHE_MAX_ENTRIES"],
+        default_ttl=app.config["API_CACHE_DEFAULT_TTL"],
+        ttls=app.config["API_CACHE_TTLS"],
+        max_stale=app.config["API_CACHE_MAX_STALE"],
+    )
+
+    # Process-wide (composer, genre) index over the local catalog
+    app.extensions["work_index"] = WorkIndex(
+        max_bytes=app.config["WORK_INDEX_MAX_BYTES"],
+        refresh_interval=app.config["CATALOG_REFRESH_SECONDS"],
+    )
+
+    # Every LLM call goes through this gateway
+    app.extensions["llm"] = create_gateway(app.config)
+
+    # Prefix index behind the composer autocomplete
+    app.extensions["composer_index"] = ComposerPrefixIndex(
+        refresh_interval=app.config["CATALOG_REFRESH_SECONDS"],
+    )
+
+
 def register_routes(app):
+    # Fetch JSON through the shared response cache, or None on failure
+    def cached_json(url):
+        try:
+            return app.extensions["api_cache"].get(url)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error fetching {redact(url)}: {redact(e)}")
+            return None
+
+    # Fetch several URLs concurrently under one overall deadline. Anything
+    # that fails or misses the deadline comes back as None.
+    def cached_json_many(urls, deadline):
+        futures = [
+            app.extensions["fanout"].submit(cached_json, url) for url in urls
+        ]
+        done, _ = wait(futures, timeout=deadline)
+        return [
+            future.result() if future in done else None for future in futures
+        ]
+
     # Define routes and corresponding functions
     @app.route("/")
     def hello_world():
@@ -69,60 +274,49 @@ def register_routes(app):
 
     @app.route("/form", methods=["GET", "POST"])
     def form():
-        composers = []
         error = None
 
+        # Composers are picked through /api/composers; just make sure the
+        # local catalog (see `flask sync_catalog`) has been filled
         try:
-            composers_url = (
-                "https://api.openopus.org/composer/list/name/all.json"
-            )
-            response = requests.get(composers_url)
-            response.raise_for_status()  # Raise exception for bad status codes
-
-            data = response.json()
-            composers = data.get("composers", [])
-        except (requests.RequestException, ValueError) as e:
+            if database.session.query(Composer.id).first() is None:
+                error = "No composers available yet. Please try again later."
+        except SQLAlchemyError as e:
             error = "Failed to fetch composers"
             print(f"Error fetching composers: {e}")
 
-        genres = [
-            "Keyboard",
-            "Orchestral",
-            "Chamber",
-            "Stage",
-            "Choral",
-            "Opera",
-            "Vocal",
-        ]
-        return render_template(
-            "form.html", composers=composers, genres=genres, error=error
-        )
+        return render_template("form.html", genres=GENRES, error=error)
 
     @app.route("/weather-mood")
     def weather_mood():
+        # A new location from the query string is remembered in the session
+        location = normalise_location(request.args.get("location"))
+        if location:
+            session["weather_location"] = location
+        else:
+            location = session.get("weather_location") or normalise_location(
+                app.config["DEFAULT_WEATHER_LOCATION"]
+            )
+
         # Fetch weather data and generate classical music suggestion
-        weather_url = (
-            "http://api.weatherapi.com/v1/current.json"
-            f"?key={app.config['WEATHER_API_KEY']}&q=London&aqi=no"
+        current_weather_url = weather_url(
+            app.config["WEATHER_API_KEY"], location
         )
+        composers_url = "https://api.openopus.org/composer/list/pop.json"
+
+        suggestion_job = None
 
         try:
-            weather_response = requests.get(weather_url)
-            weather_data = (
-                weather_response.json()
-                if weather_response.status_code == 200
-                else None
+            # Weather and composers don't depend on each other
+            weather_data, response_data = cached_json_many(
+                [current_weather_url, composers_url],
+                deadline=app.config["WEATHER_MOOD_DEADLINE"],
             )
 
             if weather_data:
-                composers_url = (
-                    "https://api.openopus.org/composer/list/pop.json"
-                )
-                composers_response = requests.get(composers_url)
                 composers = []
 
-                if composers_response.status_code == 200:
-                    response_data = composers_response.json()
+                if response_data:
                     composers_list = response_data.get("composers", [])
                     composers = composers_list[:5]
 
@@ -130,21 +324,49 @@ def register_routes(app):
                 weather_condition = weather_current.get("condition", {})
                 weather_desc = weather_condition.get("text", "")
                 temp = weather_current.get("temp_c", 0)
+                place = (
+                    weather_data.get("location", {}).get("name") or location
+                )
 
                 composer_names = [
                     composer.get("complete_name") for composer in composers
                 ]
-                model = genai.GenerativeModel("gemini-pro")
 
-                prompt = (
-                    f"Given that it's {weather_desc} and {temp}°C in London today, "
-                    "suggest a classical music piece that would complement this weather. "
-                    f"Consider selecting from works by these composers: {', '.join(composer_names)}. "
-                    "Explain briefly why this piece fits the current weather and mood. Keep your response concise but engaging."
+                # Reuse a suggestion made for similar weather if there is one
+                cache_key = suggestion_key(
+                    weather_desc,
+                    temp,
+                    composer_names,
+                    bucket_size=app.config["SUGGESTION_TEMP_BUCKET"],
+                    place=place,
+                )
+                suggestion, variants = cached_suggestion(
+                    cache_key, app.config["SUGGESTION_CACHE_TTL"]
                 )
 
-                response = model.generate_content(prompt)
-                suggestion = response.text
+                # Until the key has its full set of variants, generate
+                # another in the background. Visitors with the same key
+                # share one job, and only a page with no suggestion to
+                # show picks it up from the suggestion status endpoint.
+                max_variants = app.config["SUGGESTION_VARIANTS_PER_KEY"]
+                if variants < max_variants:
+                    prompt = (
+                        f"Given that it's {weather_desc} and {temp}°C in {place} today, "
+                        "suggest a classical music piece that would complement this weather. "
+                        f"Consider selecting from works by these composers: {', '.join(composer_names)}. "
+                        "Explain briefly why this piece fits the current weather and mood. Keep your response concise but engaging."
+                    )
+                    job = app.extensions["jobs"].submit_once(
+                        cache_key,
+                        generate_suggestion,
+                        cache_key,
+                        prompt,
+                        max_variants,
+                        app.config["SUGGESTION_CACHE_TTL"],
+                        stream=app.config["LLM_STREAMING"],
+                    )
+                    if suggestion is None:
+                        suggestion_job = job.id
             else:
                 suggestion = None
 
@@ -154,7 +376,64 @@ def register_routes(app):
             suggestion = None
 
         return render_template(
-            "weather_mood.html", weather=weather_data, suggestion=suggestion
+            "weather_mood.html",
+            weather=weather_data,
+            suggestion=suggestion,
+            suggestion_job=suggestion_job,
+            suggestion_sse=app.config["SUGGESTION_SSE"],
+            location=location,
+        )
+
+    @app.route("/weather-mood/suggestion/<job_id>")
+    def weather_mood_suggestion(job_id):
+        # Report on a background suggestion job
+        job = app.extensions["jobs"].get(job_id)
+        if job is None:
+            return jsonify(error="Unknown suggestion job"), 404
+        return jsonify(job.to_dict())
+
+    @app.route("/weather-mood/suggestion/<job_id>/events")
+    def weather_mood_suggestion_events(job_id):
+        # Push the suggestion to the browser with Server-Sent Events, when
+        # enabled. A connection lasts at most JOB_EVENTS_TIMEOUT seconds;
+        # if the job is still running the page then falls back to polling.
+        if not app.config["SUGGESTION_SSE"]:
+            return jsonify(error="Suggestion events are disabled"), 404
+        job = app.extensions["jobs"].get(job_id)
+        if job is None:
+            return jsonify(error="Unknown suggestion job"), 404
+
+        # Streamed chunks go out as "chunk" events, then one final event
+        def events():
+            deadline = time.monotonic() + app.config["JOB_EVENTS_TIMEOUT"]
+            seen = 0
+            while True:
+                chunks = job.wait_for_chunks(
+                    seen, timeout=max(deadline - time.monotonic(), 0)
+                )
+                for chunk in chunks:
+                    yield f"event: chunk\ndata: {json.dumps({'text': chunk})}\n\n"
+                seen += len(chunks)
+                if job.finished or time.monotonic() > deadline:
+                    break
+                if not chunks:
+                    yield ": keep-alive\n\n"
+            yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+
+        return Response(
+            events(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    @app.route("/stats")
+    def stats():
+        # Expose counters for the shared services
+        return jsonify(
+            http=app.extensions["http"].stats(),
+            api_cache=app.extensions["api_cache"].stats(),
+            work_index=app.extensions["work_index"].stats(),
+            llm=app.extensions["llm"].stats(),
         )
 
     @app.route("/search", methods=["POST"])
@@ -169,60 +448,83 @@ def register_routes(app):
         if not selected_genres:
             return "No genres selected. Please try again."
 
-        all_works = []
+        composer_ids = parse_composer_ids(selected_composer_ids)
+        work_index = app.extensions["work_index"]
 
-        for composer_id in selected_composer_ids:
-            composer_url = (
-                "https://api.openopus.org/composer/list/"
-                f"ids/{composer_id}.json"
+        # Streamed mode: flush each composer's rows as soon as they're ready
+        if request.form.get("stream") == "1":
+            names = lookup_composer_names(composer_ids)
+            if not names:
+                return render_template("noresults.html")
+
+            def stream_works():
+                for composer_id in composer_ids:
+                    for _, _, works in work_index.lookup(
+                        [composer_id], selected_genres
+                    ):
+                        yield from works
+
+            return stream_template(
+                "results.html",
+                name=name,
+                works=stream_works(),
+                composers=sorted(set(names.values())),
             )
-            composer_response = requests.get(composer_url)
-            composer_name = "Unknown Composer"
 
-            if composer_response.status_code == 200:
-                composer_data = composer_response.json()
-                composer_name = composer_data.get("composers", [{}])[0].get(
-                    "complete_name", "Unknown Composer"
-                )
+        # Look the works up in the in-memory (composer, genre) index
+        composer_results = work_index.lookup(composer_ids, selected_genres)
 
-            works_url = (
-                "https://api.openopus.org/work/list/composer/"
-                f"{composer_id}/genre/all.json"
-            )
-            response = requests.get(works_url)
-
-            if response.status_code == 200:
-                data = response.json()
-                composer_works = data.get("works", [])
-                filtered_works = [
-                    {
-                        "title": work.get("title", ""),
-                        "genre": work.get("genre", ""),
-                        "subtitle": work.get("subtitle", ""),
-                        "popular": work.get("popular") == "1",
-                        "recommended": work.get("recommended") == "1",
-                        "composer_name": composer_name,
-                        "composer_id": composer_id,
-                    }
-                    for work in composer_works
-                    if work.get("genre") in selected_genres
-                ]
-                all_works.extend(filtered_works)
-            else:
-                return render_template("noresults.html")
+        # Composers whose works haven't been synced yet are skipped
+        if not composer_results:
+            return render_template("noresults.html")
 
-        unique_composers = sorted(
-            list(set(work["composer_name"] for work in all_works))
+        all_works = []
+        for _, _, works in composer_results:
+            all_works.extend(works)
+
+        # Serve one page of results, starting at the cursor offset
+        page_size = bounded_int(
+            request.form.get("page_size"),
+            default=app.config["SEARCH_PAGE_SIZE"],
+            low=1,
+            high=app.config["SEARCH_MAX_PAGE_SIZE"],
+        )
+        cursor = bounded_int(
+            request.form.get("cursor"), default=0, low=0, high=len(all_works)
         )
+        # A cursor past the end (e.g. a stale form) shows the last page
+        if cursor >= len(all_works):
+            cursor = max(len(all_works) - 1, 0) // page_size * page_size
+        page = all_works[cursor : cursor + page_size]
+        next_cursor = cursor + page_size
+        if next_cursor >= len(all_works):
+            next_cursor = None
+
+        unique_composers = sorted(set(name for _, name, _ in composer_results))
 
         return render_template(
             "results.html",
             name=name,
-            works=all_works,
+            works=page,
             composers=unique_composers,
+            total=len(all_works),
+            cursor=cursor,
+            page_size=page_size,
+            next_cursor=next_cursor,
+            composer_ids=composer_ids,
+            genres=selected_genres,
         )
 
 
+# Parse an int form value, clamped to [low, high]
+def bounded_int(value, default, low, high):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(low, min(number, high))
+
+
 # Only create production app if running directly
 if __name__ == "__main__":
     app = create_app()
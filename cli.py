@@ -1,7 +1,10 @@
 import click
+import os
+from datetime import timedelta
 from flask.cli import with_appcontext
 from database import db as database
 from models.musicpiece import MusicPiece
+from services import catalog, descriptions, fulltext, library, migrations
 
 
 # Create all tables in the database
@@ -9,6 +12,9 @@ from models.musicpiece import MusicPiece
 @with_appcontext
 def create_all():
     database.create_all()
+    # create_all skips tables that already exist, so bring those up to date
+    # too (every migration is safe to run on a brand new schema)
+    migrations.migrate(echo=click.echo)
 
 
 # Drop all tables in the database
@@ -48,3 +54,137 @@ def populate():
     for piece in initial_music_pieces:
         database.session.add(piece)
     database.session.commit()
+
+
+# Mirror the OpenOpus catalog into the local database
+@click.command(
+    "sync_catalog", help="Download the OpenOpus catalog into the database"
+)
+@click.option("--full", is_flag=True, help="Re-download every work list")
+@click.option(
+    "--max-age-days",
+    default=7,
+    show_default=True,
+    help="Refresh work lists older than this many days",
+)
+@click.option("--workers", default=8, show_default=True)
+@click.option("--timeout", default=10.0, show_default=True)
+@with_appcontext
+def sync_catalog(full, max_age_days, workers, timeout):
+    synced, failed = catalog.sync_catalog(
+        full=full,
+        max_age=timedelta(days=max_age_days),
+        workers=workers,
+        timeout=timeout,
+        echo=click.echo,
+    )
+    click.echo(f"Catalog sync done: {synced} updated, {failed} failed")
+
+
+# Rebuild the full-text search index from the local catalog
+@click.command(
+    "rebuild_search_index", help="Rebuild the full-text index of works"
+)
+@with_appcontext
+def rebuild_search_index():
+    fulltext.rebuild()
+    click.echo("Search index rebuilt")
+
+
+# Drop stored AI descriptions so they are regenerated on next view
+@click.command(
+    "invalidate_descriptions",
+    help="Delete stored AI piece descriptions (all unless --piece-id)",
+)
+@click.option(
+    "--piece-id", "piece_ids", type=int, multiple=True, help="Repeatable"
+)
+@with_appcontext
+def invalidate_descriptions(piece_ids):
+    deleted = descriptions.invalidate_descriptions(list(piece_ids) or None)
+    click.echo(f"Invalidated {deleted} descriptions")
+
+
+# Warm the description store ahead of the first views
+@click.command(
+    "pregenerate_descriptions",
+    help="Generate AI descriptions for pieces that don't have one yet",
+)
+@click.option("--workers", default=4, show_default=True)
+@click.option(
+    "--rpm",
+    default=60,
+    show_default=True,
+    help="Maximum LLM requests started per minute, in place of LLM_RPM "
+    "(0 to use LLM_RPM)",
+)
+@click.option("--batch-size", default=50, show_default=True)
+@with_appcontext
+def pregenerate_descriptions(workers, rpm, batch_size):
+    generated, failed = descriptions.pregenerate_descriptions(
+        workers=workers, rpm=rpm, batch_size=batch_size, echo=click.echo
+    )
+    click.echo(
+        f"Description pre-generation done: {generated} generated, "
+        f"{failed} failed"
+    )
+
+
+# Bulk-import pieces into a user's library
+@click.command(
+    "import_library", help="Import a CSV or JSON file into a user's library"
+)
+@click.argument("user_name")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["csv", "json"]),
+    help="Defaults to the file extension",
+)
+@click.option("--chunk-size", default=500, show_default=True)
+@with_appcontext
+def import_library(user_name, path, fmt, chunk_size):
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    with open(path, encoding="utf-8-sig") as f:
+        try:
+            rows = library.parse_import(f.read(), fmt)
+        except ValueError as e:
+            raise click.ClickException(f"Could not read {path}: {e}")
+    counts = library.import_pieces(user_name, rows, chunk_size)
+    click.echo(
+        f"Imported {counts['added']} pieces for {user_name} "
+        f"({counts['already_saved']} already saved, "
+        f"{counts['invalid']} invalid)"
+    )
+
+
+# Delete music pieces that are no longer in anyone's library
+@click.command(
+    "gc_orphaned_pieces",
+    help="Delete music pieces no user library refers to, in batches",
+)
+@click.option("--batch-size", default=500, show_default=True)
+@with_appcontext
+def gc_orphaned_pieces(batch_size):
+    deleted = library.collect_orphaned_pieces(
+        batch_size=batch_size, echo=click.echo
+    )
+    click.echo(f"Orphan cleanup done: {deleted} pieces deleted")
+
+
+# Bring an existing database's schema up to date
+@click.command("migrate", help="Apply pending schema migrations")
+@click.option(
+    "--status", is_flag=True, help="List pending migrations without applying"
+)
+@with_appcontext
+def migrate(status):
+    if status:
+        pending = migrations.pending_migrations()
+        for version, name, _ in pending:
+            click.echo(f"Pending migration {version}: {name}")
+        click.echo(f"{len(pending)} pending migrations")
+        return
+    applied = migrations.migrate(echo=click.echo)
+    click.echo(f"Schema up to date ({len(applied)} migrations applied)")
@@ -0,0 +1,29 @@
+from database import db
+
+
+# Setup of Composer Class, mirrored from the OpenOpus catalog
+class Composer(db.Model):
+    __tablename__ = "composers"
+
+    # Columns (id is the OpenOpus composer id)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(120), nullable=False)
+    complete_name = db.Column(db.String(200), nullable=False)
+    epoch = db.Column(db.String(80), nullable=True)
+    birth = db.Column(db.String(20), nullable=True)
+    death = db.Column(db.String(20), nullable=True)
+
+    # When this composer's works were last downloaded (None = never)
+    works_synced_at = db.Column(db.DateTime, nullable=True)
+
+    # Relationship between Composer and Work models
+    works = db.relationship(
+        "Work",
+        backref="composer",
+        order_by="Work.id",
+        cascade="all, delete-orphan",
+    )
+
+    # String representation
+    def __repr__(self):
+        return f"<Composer {self.id}: {self.complete_name}>"
@@ -0,0 +1,30 @@
+from database import db
+
+
+# Setup of PieceDescription Class, storing AI descriptions of music pieces
+class PieceDescription(db.Model):
+    __tablename__ = "piece_descriptions"
+
+    # Columns
+    music_piece_id = db.Column(
+        db.Integer, db.ForeignKey("music_pieces.id"), primary_key=True
+    )
+    text = db.Column(db.Text, nullable=False)
+    model = db.Column(db.String(80), nullable=False)
+    prompt_version = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    # Relationship between MusicPiece and its description
+    music_piece = db.relationship(
+        "MusicPiece",
+        backref=db.backref(
+            "description", uselist=False, cascade="all, delete-orphan"
+        ),
+    )
+
+    # String representation
+    def __repr__(self):
+        return (
+            f"<PieceDescription MusicPiece {self.music_piece_id}, "
+            f"v{self.prompt_version}>"
+        )
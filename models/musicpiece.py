@@ -14,11 +14,13 @@ class MusicPiece(db.Model):
     popular = db.Column(db.Boolean, nullable=False)
     recommended = db.Column(db.Boolean, nullable=False)
 
-    # Checking for unique entries
+    # Checking for unique entries (its index also serves composer lookups)
+    # and indexing genre filters
     __table_args__ = (
         db.UniqueConstraint(
             "composer", "title", "subtitle", name="unique_music_piece"
         ),
+        db.Index("ix_music_pieces_genre_composer", "genre", "composer"),
     )
 
     # String representation
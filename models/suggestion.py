@@ -0,0 +1,16 @@
+from database import db
+
+
+# Setup of WeatherSuggestion Class, caching AI weather-mood suggestions
+class WeatherSuggestion(db.Model):
+    __tablename__ = "weather_suggestions"
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), nullable=False, index=True)
+    text = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    # String representation
+    def __repr__(self):
+        return f"<WeatherSuggestion {self.id}: {self.cache_key}>"
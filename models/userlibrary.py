@@ -9,8 +9,13 @@ class UserLibrary(db.Model):
     user_id = db.Column(
         db.Integer, db.ForeignKey("users.id"), primary_key=True
     )
+    # Indexed on its own for "who saved this piece" lookups, which the
+    # (user_id, music_piece_id) primary key can't serve
     music_piece_id = db.Column(
-        db.Integer, db.ForeignKey("music_pieces.id"), primary_key=True
+        db.Integer,
+        db.ForeignKey("music_pieces.id"),
+        primary_key=True,
+        index=True,
     )
 
     # Relationship between User and UserLibrary models
@@ -0,0 +1,21 @@
+from database import db
+
+
+# Setup of Work Class, mirrored from the OpenOpus catalog
+class Work(db.Model):
+    __tablename__ = "works"
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True)
+    composer_id = db.Column(
+        db.Integer, db.ForeignKey("composers.id"), nullable=False, index=True
+    )
+    title = db.Column(db.String(300), nullable=False)
+    subtitle = db.Column(db.String(300), nullable=True)
+    genre = db.Column(db.String(80), nullable=False)
+    popular = db.Column(db.Boolean, nullable=False, default=False)
+    recommended = db.Column(db.Boolean, nullable=False, default=False)
+
+    # String representation
+    def __repr__(self):
+        return f"<Work {self.id}: {self.title}>"
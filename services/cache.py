@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import threading
+import time
+from services.http import redact
+
+
+# In-memory response cache keyed by URL, with per-endpoint TTLs, a bounded
+# LRU size and stale-while-revalidate: once an entry expires the stale copy
+# is still served while a single background thread refreshes it. An entry
+# more than max_stale seconds past expiry (e.g. because refreshes keep
+# failing) is treated as a miss and fetched in the foreground.
+class ResponseCache:
+    def __init__(
+        self,
+        fetch,
+        max_entries=512,
+        default_ttl=300,
+        ttls=None,
+        max_stale=3600,
+    ):
+        self.fetch = fetch
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_stale = max_stale
+        # URL prefix -> TTL in seconds; the longest matching prefix wins
+        self.ttls = dict(ttls or {})
+
+        self._entries = OrderedDict()  # url -> (value, expires_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refresh_errors = 0
+
+    def ttl_for(self, url):
+        matches = [prefix for prefix in self.ttls if url.startswith(prefix)]
+        if not matches:
+            return self.default_ttl
+        return self.ttls[max(matches, key=len)]
+
+    # Return the cached JSON for a URL, fetching it on a miss
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            now = time.monotonic()
+            if entry is not None and now > entry[1] + self.max_stale:
+                # Too stale to serve
+                del self._entries[url]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(url)
+                value, expires_at = entry
+                if now < expires_at:
+                    self.hits += 1
+                    return value
+
+                # Expired: serve the stale copy and refresh it once
+                self.stale_hits += 1
+                if url not in self._refreshing:
+                    self._refreshing.add(url)
+                    threading.Thread(
+                        target=self._refresh, args=(url,), daemon=True
+                    ).start()
+                return value
+
+            self.misses += 1
+
+        value = self.fetch(url)
+        self.set(url, value)
+        return value
+
+    def set(self, url, value):
+        expires_at = time.monotonic() + self.ttl_for(url)
+        with self._lock:
+            self._entries[url] = (value, expires_at)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _refresh(self, url):
+        try:
+            self.set(url, self.fetch(url))
+        except Exception as e:
+            # Keep serving the stale copy; the next hit retries
+            print(f"Error refreshing {redact(url)}: {redact(e)}")
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(url)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refresh_errors": self.refresh_errors,
+            }
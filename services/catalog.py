@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, or_
+from database import db
+from models.composer import Composer
+from models.work import Work
+from services import fulltext
+from services.http import get_http
+from services.openopus import fetch_all_composers, fetch_works_concurrently
+
+
+# Naive UTC timestamp, matching how SQLite stores DateTime columns
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Largest value SQLite can store in an INTEGER column
+MAX_SQLITE_INTEGER = 2**63 - 1
+
+
+# Convert submitted composer ids to ints, dropping anything invalid or
+# outside the positive SQLite INTEGER range
+def parse_composer_ids(values):
+    composer_ids = []
+    for value in values:
+        try:
+            composer_id = int(value)
+        except (TypeError, ValueError):
+            continue
+        if 0 < composer_id <= MAX_SQLITE_INTEGER:
+            composer_ids.append(composer_id)
+    return composer_ids
+
+
+# Resolve many composer ids to names in one query. Composers whose works
+# haven't been synced yet are left out.
+def composer_names(composer_ids):
+    if not composer_ids:
+        return {}
+    rows = db.session.execute(
+        db.select(Composer.id, Composer.complete_name).where(
+            Composer.id.in_(composer_ids),
+            Composer.works_synced_at.is_not(None),
+        )
+    )
+    return {composer_id: name for composer_id, name in rows}
+
+
+# Short string that changes whenever the synced catalog changes
+def catalog_version():
+    count, last_synced = db.session.execute(
+        db.select(func.count(Composer.id), func.max(Composer.works_synced_at))
+    ).one()
+    stamp = last_synced.isoformat() if last_synced else "never"
+    return f"{count}-{stamp}"
+
+
+# Insert or update every composer from the OpenOpus composer list
+def sync_composers(http, timeout=None):
+    composers = fetch_all_composers(http, timeout=timeout)
+    existing = {composer.id: composer for composer in Composer.query.all()}
+
+    for data in composers:
+        try:
+            composer_id = int(data["id"])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        composer = existing.get(composer_id)
+        if composer is None:
+            composer = Composer(id=composer_id)
+            db.session.add(composer)
+            existing[composer_id] = composer
+
+        composer.name = data.get("name") or ""
+        composer.complete_name = data.get("complete_name") or composer.name
+        composer.epoch = data.get("epoch")
+        composer.birth = data.get("birth")
+        composer.death = data.get("death")
+
+    db.session.commit()
+    return len(existing)
+
+
+# Ids of composers whose works are missing or older than max_age
+def composers_to_sync(full=False, max_age=None):
+    query = Composer.query
+    if not full:
+        condition = Composer.works_synced_at.is_(None)
+        if max_age is not None:
+            condition = or_(
+                condition, Composer.works_synced_at < utcnow() - max_age
+            )
+        query = query.filter(condition)
+    return [composer.id for composer in query.order_by(Composer.id)]
+
+
+# Replace a composer's stored works with a freshly downloaded list
+def store_composer_works(composer_id, works):
+    fulltext.unindex_composer_works(composer_id)
+    Work.query.filter_by(composer_id=composer_id).delete()
+    db.session.add_all(
+        Work(
+            composer_id=composer_id,
+            title=work.get("title") or "",
+            subtitle=work.get("subtitle") or "",
+            genre=work.get("genre") or "",
+            popular=work.get("popular") == "1",
+            recommended=work.get("recommended") == "1",
+        )
+        for work in works
+    )
+    fulltext.index_composer_works(composer_id)
+    db.session.get(Composer, composer_id).works_synced_at = utcnow()
+
+
+# Download composers and any stale work lists into the local catalog.
+# Progress is committed after every batch, so an interrupted sync picks
+# up where it left off on the next run.
+def sync_catalog(
+    full=False,
+    max_age=timedelta(days=7),
+    workers=8,
+    timeout=10.0,
+    batch_size=50,
+    echo=print,
+):
+    http = get_http()
+    fulltext.ensure_table()
+    composer_count = sync_composers(http, timeout=timeout)
+    echo(f"Synced {composer_count} composers")
+
+    pending = composers_to_sync(full=full, max_age=max_age)
+    echo(f"{len(pending)} composers need their works refreshed")
+
+    synced = failed = 0
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start : start + batch_size]
+        results = fetch_works_concurrently(
+            http, batch, max_workers=workers, deadline=timeout
+        )
+
+        for composer_id, works in zip(batch, results):
+            if works is None:
+                failed += 1
+                continue
+            store_composer_works(composer_id, works)
+            synced += 1
+
+        db.session.commit()
+        echo(f"Progress: {start + len(batch)}/{len(pending)} composers")
+
+    return synced, failed
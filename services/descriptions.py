@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from sqlalchemy.dialects.sqlite import insert
+from database import db
+from models.description import PieceDescription
+from models.musicpiece import MusicPiece
+from services.catalog import utcnow
+from services.llm import get_llm
+
+# Bump whenever piece_description_prompt changes so stored descriptions
+# written with the old prompt get regenerated
+PROMPT_VERSION = 1
+
+
+# Build the LLM prompt for a piece's description
+def piece_description_prompt(piece):
+    return (
+        f"Generate a brief, engaging description (2-3 sentences) of the following classical music piece:\n"
+        f"Title: {piece.title}\n"
+        f"Composer: {piece.composer}\n"
+        f"Genre: {piece.genre}\n"
+        f"Additional info: {'This is a popular piece. ' if piece.popular else ''}"
+        f"{'This piece is highly recommended by critics. ' if piece.recommended else ''}\n"
+        "Focus on what makes this piece special and its historical or musical significance."
+    )
+
+
+# Model label saved with each description, e.g. "gemini:gemini-pro"
+def model_label(llm):
+    return f"{llm.backend.name}:{llm.model_name}"
+
+
+# The stored description for a piece under the current prompt, or None
+def stored_description(piece_id):
+    description = db.session.get(PieceDescription, piece_id)
+    if description is None or description.prompt_version != PROMPT_VERSION:
+        return None
+    return description.text
+
+
+# Save (or replace) a piece's description with a single
+# INSERT ... ON CONFLICT DO UPDATE, so concurrent first views of a piece
+# don't race on the primary key
+def store_description(piece_id, text, model, commit=True):
+    values = {
+        "text": text,
+        "model": model,
+        "prompt_version": PROMPT_VERSION,
+        "created_at": utcnow(),
+    }
+    db.session.execute(
+        insert(PieceDescription)
+        .values(music_piece_id=piece_id, **values)
+        .on_conflict_do_update(index_elements=["music_piece_id"], set_=values)
+    )
+    if commit:
+        db.session.commit()
+
+
+# Stored description, generating and saving one on a miss. Concurrent
+# misses share one LLM call through the gateway and each saves the same
+# text, which the upsert in store_description makes safe.
+def describe_piece(piece):
+    text = stored_description(piece.id)
+    if text is None:
+        llm = get_llm()
+        text = llm.generate(piece_description_prompt(piece))
+        store_description(piece.id, text, model_label(llm))
+    return text
+
+
+# Delete stored descriptions (all of them when piece_ids is None) so they
+# are regenerated on next view. Returns how many were removed.
+def invalidate_descriptions(piece_ids=None):
+    query = PieceDescription.query
+    if piece_ids is not None:
+        query = query.filter(PieceDescription.music_piece_id.in_(piece_ids))
+    deleted = query.delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+# Next batch of pieces after `after_id` with no description under the
+# current prompt, in id order
+def pieces_missing_descriptions(after_id=0, limit=50):
+    return (
+        MusicPiece.query.outerjoin(
+            PieceDescription,
+            (PieceDescription.music_piece_id == MusicPiece.id)
+            & (PieceDescription.prompt_version == PROMPT_VERSION),
+        )
+        .filter(
+            PieceDescription.music_piece_id.is_(None),
+            MusicPiece.id > after_id,
+        )
+        .order_by(MusicPiece.id)
+        .limit(limit)
+        .all()
+    )
+
+
+# Generate descriptions for every piece that lacks one. LLM calls run on
+# `workers` threads, started no faster than `rpm` per minute. That pacing
+# replaces the gateway's LLM_RPM limiter for the run (rpm=0 keeps the
+# limiter instead). Results are saved from this thread and committed once
+# per batch, so an interrupted run picks up where the last commit left
+# off. Returns (generated, failed).
+def pregenerate_descriptions(workers=4, rpm=60, batch_size=50, echo=print):
+    llm = get_llm()
+    model = model_label(llm)
+    interval = 60.0 / rpm if rpm else 0
+    next_start = time.monotonic()
+    generated = failed = 0
+    after_id = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = pieces_missing_descriptions(after_id, batch_size)
+            if not batch:
+                break
+            after_id = batch[-1].id
+
+            futures = {}
+            for piece in batch:
+                delay = next_start - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_start = max(next_start, time.monotonic()) + interval
+                prompt = piece_description_prompt(piece)
+                future = pool.submit(
+                    llm.generate, prompt, rate_limited=not rpm
+                )
+                futures[future] = piece.id
+
+            for future in as_completed(futures):
+                piece_id = futures[future]
+                try:
+                    text = future.result()
+                except Exception as e:
+                    failed += 1
+                    echo(f"Failed to describe piece {piece_id}: {e}")
+                    continue
+                store_description(piece_id, text, model, commit=False)
+                generated += 1
+
+            db.session.commit()
+            echo(f"Described pieces up to id {after_id}: {generated} done")
+
+    return generated, failed
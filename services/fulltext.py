@@ -0,0 +1,112 @@
+import re
+from sqlalchemy import DDL, event, text
+from database import db
+from models.work import Work
+
+# Full-text index over work titles, subtitles and composer names. It is a
+# standalone FTS5 table whose rowid is the Work id.
+CREATE_FTS_TABLE = DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS works_fts USING fts5("
+    "title, subtitle, composer_name, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP_FTS_TABLE = DDL("DROP TABLE IF EXISTS works_fts")
+
+# Keep the FTS table's lifecycle tied to the works table
+event.listen(
+    Work.__table__,
+    "after_create",
+    CREATE_FTS_TABLE.execute_if(dialect="sqlite"),
+)
+event.listen(
+    Work.__table__, "before_drop", DROP_FTS_TABLE.execute_if(dialect="sqlite")
+)
+
+# Column weights for bm25 ranking: title, subtitle, composer_name
+RANK = "bm25(works_fts, 10.0, 5.0, 2.0)"
+
+INDEX_WORKS = """
+    INSERT INTO works_fts (rowid, title, subtitle, composer_name)
+    SELECT works.id, works.title, works.subtitle, composers.complete_name
+    FROM works JOIN composers ON composers.id = works.composer_id
+"""
+
+
+def ensure_table():
+    db.session.execute(text(CREATE_FTS_TABLE.statement))
+
+
+# Drop a composer's works from the index. Call before deleting the rows.
+def unindex_composer_works(composer_id):
+    db.session.execute(
+        text(
+            "DELETE FROM works_fts WHERE rowid IN "
+            "(SELECT id FROM works WHERE composer_id = :composer_id)"
+        ),
+        {"composer_id": composer_id},
+    )
+
+
+# Add a composer's current works to the index
+def index_composer_works(composer_id):
+    db.session.flush()
+    db.session.execute(
+        text(INDEX_WORKS + " WHERE works.composer_id = :composer_id"),
+        {"composer_id": composer_id},
+    )
+
+
+# Rebuild the whole index from the catalog tables
+def rebuild():
+    ensure_table()
+    db.session.execute(text("DELETE FROM works_fts"))
+    db.session.execute(text(INDEX_WORKS))
+    db.session.commit()
+
+
+# Turn free text into a safe FTS5 query: every word, as a prefix, must match
+def to_match_query(query):
+    tokens = re.findall(r"\w+", query or "")
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+# Ranked, paginated search. Returns (total, list of result dicts).
+def search(query, page=1, per_page=20):
+    match = to_match_query(query)
+    if not match:
+        return 0, []
+
+    total = db.session.execute(
+        text("SELECT count(*) FROM works_fts WHERE works_fts MATCH :match"),
+        {"match": match},
+    ).scalar()
+
+    rows = db.session.execute(
+        text(
+            "SELECT works.id, works.composer_id, works_fts.composer_name, "
+            "works.title, works.subtitle, works.genre, works.popular, "
+            "works.recommended "
+            "FROM works_fts JOIN works ON works.id = works_fts.rowid "
+            f"WHERE works_fts MATCH :match ORDER BY {RANK} "
+            "LIMIT :limit OFFSET :offset"
+        ),
+        {
+            "match": match,
+            "limit": per_page,
+            "offset": (page - 1) * per_page,
+        },
+    )
+    results = [
+        {
+            "id": row.id,
+            "composer_id": str(row.composer_id),
+            "composer_name": row.composer_name,
+            "title": row.title,
+            "subtitle": row.subtitle or "",
+            "genre": row.genre,
+            "popular": bool(row.popular),
+            "recommended": bool(row.recommended),
+        }
+        for row in rows
+    ]
+    return total, results
@@ -0,0 +1,90 @@
+from flask import current_app
+import re
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Shared HTTP client: one pooled keep-alive session with default timeouts
+# and retry-with-backoff on idempotent requests
+class HttpClient:
+    def __init__(
+        self,
+        pool_size=10,
+        connect_timeout=3.05,
+        read_timeout=10,
+        retries=3,
+        backoff_factor=0.3,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with self._lock:
+            self.requests += 1
+        try:
+            return self.session.get(url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self.errors += 1
+            raise
+
+    # Download a URL and decode its JSON body, raising on bad status codes
+    def get_json(self, url, **kwargs):
+        response = self.get(url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self):
+        pools = []
+        poolmanager = self.adapter.poolmanager
+        for key in list(poolmanager.pools.keys()):
+            pool = poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append(
+                {
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle": pool.pool.qsize() if pool.pool else 0,
+                    "max_size": pool.pool.maxsize if pool.pool else 0,
+                }
+            )
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "pools": pools,
+            }
+
+
+# Drop query strings from a URL, or from an error message that quotes one,
+# before logging it: they can carry API keys
+def redact(text):
+    return re.sub(r"\?[^\s'\")]*", "", str(text))
+
+
+# The app's shared HTTP client
+def get_http():
+    return current_app.extensions["http"]
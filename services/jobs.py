@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+
+
+# State of one background job
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.chunks = []  # partial output, for jobs that stream
+        self.created_at = time.monotonic()
+        self.changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def update(self, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.changed.notify_all()
+
+    def add_chunk(self, text):
+        with self.changed:
+            self.chunks.append(text)
+            self.changed.notify_all()
+
+    # Block until the job finishes or the timeout passes
+    def wait(self, timeout=None):
+        with self.changed:
+            self.changed.wait_for(lambda: self.finished, timeout=timeout)
+        return self.finished
+
+    # Block until there are chunks past `seen`, the job finishes, or the
+    # timeout passes. Returns the new chunks.
+    def wait_for_chunks(self, seen, timeout=None):
+        with self.changed:
+            self.changed.wait_for(
+                lambda: self.finished or len(self.chunks) > seen,
+                timeout=timeout,
+            )
+            return self.chunks[seen:]
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "partial": "".join(self.chunks),
+            "error": self.error,
+        }
+
+
+# Runs slow work (LLM calls) off the request threads. Jobs run inside an
+# app context, get their Job as the first argument (to report partial
+# output) and are kept for max_age seconds so clients can poll them.
+class JobRunner:
+    def __init__(self, app, max_workers=4, max_age=600):
+        self.app = app
+        self.max_age = max_age
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="jobs"
+        )
+        self._jobs = OrderedDict()
+        self._running = {}  # key -> unfinished job, for submit_once
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    # Like submit, but while a job for `key` is still unfinished it is
+    # returned instead of starting a duplicate
+    def submit_once(self, key, func, *args, **kwargs):
+        with self._lock:
+            job = self._running.get(key)
+            if job is not None and not job.finished:
+                return job
+            job = Job(uuid.uuid4().hex)
+            self._expire()
+            self._jobs[job.id] = job
+            self._running[key] = job
+        self._executor.submit(self._run, job, func, args, kwargs, key)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, args, kwargs, key=None):
+        job.update(status="running")
+        try:
+            with self.app.app_context():
+                result = func(job, *args, **kwargs)
+        except Exception as e:
+            print(f"Background job {job.id} failed: {e}")
+            job.update(status="failed", error=str(e))
+        else:
+            job.update(status="done", result=result)
+        finally:
+            if key is not None:
+                with self._lock:
+                    if self._running.get(key) is job:
+                        del self._running[key]
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.max_age
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job.created_at >= cutoff:
+                break
+            self._jobs.popitem(last=False)
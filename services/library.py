@@ -0,0 +1,317 @@
+import base64
+import csv
+import io
+import json
+from sqlalchemy import delete, exists, or_, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from database import db
+from models.description import PieceDescription
+from models.musicpiece import MusicPiece
+from models.user import User
+from models.userlibrary import UserLibrary
+
+# Columns a library listing can be sorted by
+LIBRARY_SORTS = {
+    "composer": MusicPiece.composer,
+    "title": MusicPiece.title,
+    "genre": MusicPiece.genre,
+}
+
+
+# Opaque keyset cursor: the sort value and id of the last row shown
+def encode_cursor(value, piece_id):
+    raw = json.dumps([value, piece_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+# (value, id) from a cursor, or None if it is missing or malformed
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        value, piece_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(value, str) or not isinstance(piece_id, int):
+        return None
+    return value, piece_id
+
+
+# Escape LIKE wildcards in user input
+def like_pattern(text):
+    escaped = (
+        text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    )
+    return f"%{escaped}%"
+
+
+# One page of a user's library in a single query. Pieces are ordered by
+# the sort column then id, and `cursor` continues after the last row of
+# the previous page. Returns (pieces, next_cursor).
+def library_page(
+    user_name,
+    sort="composer",
+    composer=None,
+    genre=None,
+    popular=False,
+    recommended=False,
+    cursor=None,
+    page_size=50,
+):
+    sort_column = LIBRARY_SORTS.get(sort, MusicPiece.composer)
+    query = (
+        db.session.query(MusicPiece)
+        .join(UserLibrary, UserLibrary.music_piece_id == MusicPiece.id)
+        .join(User, User.id == UserLibrary.user_id)
+        .filter(User.username == user_name)
+    )
+
+    if composer:
+        query = query.filter(
+            MusicPiece.composer.ilike(like_pattern(composer), escape="\\")
+        )
+    if genre:
+        query = query.filter(MusicPiece.genre == genre)
+    if popular:
+        query = query.filter(MusicPiece.popular.is_(True))
+    if recommended:
+        query = query.filter(MusicPiece.recommended.is_(True))
+
+    after = decode_cursor(cursor)
+    if after is not None:
+        value, piece_id = after
+        query = query.filter(
+            or_(
+                sort_column > value,
+                (sort_column == value) & (MusicPiece.id > piece_id),
+            )
+        )
+
+    # Fetch one extra row to find out whether there is a next page
+    pieces = (
+        query.order_by(sort_column, MusicPiece.id).limit(page_size + 1).all()
+    )
+    next_cursor = None
+    if len(pieces) > page_size:
+        pieces = pieces[:page_size]
+        last = pieces[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), last.id)
+    return pieces, next_cursor
+
+
+# Insert a row unless it clashes with the unique `keys`, and return its
+# id either way: INSERT ... ON CONFLICT DO NOTHING RETURNING id, then a
+# SELECT only when the row already existed
+def insert_or_get_id(model, values, keys):
+    row_id = db.session.execute(
+        insert(model)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=keys)
+        .returning(model.id)
+    ).scalar()
+    if row_id is None:
+        row_id = db.session.execute(
+            select(model.id).filter_by(**{key: values[key] for key in keys})
+        ).scalar_one()
+    return row_id
+
+
+# Save a piece to a user's library, creating the user and the piece as
+# needed, in one transaction. A missing subtitle is stored as "" because
+# SQLite treats NULLs as distinct in the unique (composer, title,
+# subtitle) constraint. Returns False if the piece was already saved.
+def add_to_library(
+    user_name, composer, title, subtitle, genre, popular, recommended
+):
+    user_id = insert_or_get_id(User, {"username": user_name}, ["username"])
+    piece_id = insert_or_get_id(
+        MusicPiece,
+        {
+            "composer": composer,
+            "title": title,
+            "subtitle": subtitle or "",
+            "genre": genre,
+            "popular": popular,
+            "recommended": recommended,
+        },
+        ["composer", "title", "subtitle"],
+    )
+    added = db.session.execute(
+        insert(UserLibrary)
+        .values(user_id=user_id, music_piece_id=piece_id)
+        .on_conflict_do_nothing()
+    ).rowcount
+    db.session.commit()
+    return added == 1
+
+
+# Columns of a library import, in the order used by CSV files and by
+# JSON rows given as lists
+IMPORT_FIELDS = [
+    "composer",
+    "title",
+    "subtitle",
+    "genre",
+    "popular",
+    "recommended",
+]
+
+
+# Parse an import file ("csv" with a header row, or "json": a list of
+# objects or of lists in IMPORT_FIELDS order) into a list of dicts.
+# Raises ValueError if the file can't be read.
+def parse_import(text, fmt):
+    if fmt == "csv":
+        return list(csv.DictReader(io.StringIO(text)))
+    if fmt == "json":
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError("JSON import must be a list")
+        return [
+            dict(zip(IMPORT_FIELDS, row)) if isinstance(row, list) else row
+            for row in rows
+        ]
+    raise ValueError(f"Unknown import format: {fmt}")
+
+
+def parse_flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+
+# A clean piece row, or None if it lacks a composer or title
+def clean_import_row(row):
+    if not isinstance(row, dict):
+        return None
+    composer = str(row.get("composer") or "").strip()
+    title = str(row.get("title") or "").strip()
+    if not composer or not title:
+        return None
+    return {
+        "composer": composer,
+        "title": title,
+        "subtitle": str(row.get("subtitle") or "").strip(),
+        "genre": str(row.get("genre") or "").strip(),
+        "popular": parse_flag(row.get("popular")),
+        "recommended": parse_flag(row.get("recommended")),
+    }
+
+
+# Add many pieces to a user's library in one transaction. Rows are
+# de-duplicated on (composer, title, subtitle) in memory, then written in
+# chunks: one executemany INSERT OR IGNORE for the pieces, one SELECT for
+# their ids and one executemany INSERT OR IGNORE for the library entries.
+# Returns counts of rows added, already saved (or repeated) and invalid.
+def import_pieces(user_name, rows, chunk_size=500):
+    pieces = {}
+    invalid = 0
+    for row in rows:
+        piece = clean_import_row(row)
+        if piece is None:
+            invalid += 1
+            continue
+        key = (piece["composer"], piece["title"], piece["subtitle"])
+        pieces.setdefault(key, piece)
+
+    user_id = insert_or_get_id(User, {"username": user_name}, ["username"])
+    unique = list(pieces.values())
+    added = 0
+    # Core executemany on the session's connection (same transaction)
+    connection = db.session.connection()
+    for start in range(0, len(unique), chunk_size):
+        chunk = unique[start : start + chunk_size]
+        connection.execute(
+            insert(MusicPiece).on_conflict_do_nothing(
+                index_elements=["composer", "title", "subtitle"]
+            ),
+            chunk,
+        )
+        keys = [
+            (piece["composer"], piece["title"], piece["subtitle"])
+            for piece in chunk
+        ]
+        piece_ids = connection.execute(
+            select(MusicPiece.id).where(
+                tuple_(
+                    MusicPiece.composer, MusicPiece.title, MusicPiece.subtitle
+                ).in_(keys)
+            )
+        ).scalars()
+        added += connection.execute(
+            insert(UserLibrary).on_conflict_do_nothing(),
+            [
+                {"user_id": user_id, "music_piece_id": piece_id}
+                for piece_id in piece_ids
+            ],
+        ).rowcount
+    db.session.commit()
+
+    return {
+        "added": added,
+        "already_saved": len(rows) - invalid - added,
+        "invalid": invalid,
+    }
+
+
+# Delete whichever of `piece_ids` no library still references, along with
+# their stored descriptions. Returns how many pieces were deleted; the
+# caller commits.
+def delete_if_orphaned(piece_ids):
+    orphan_ids = list(
+        db.session.execute(
+            select(MusicPiece.id).where(
+                MusicPiece.id.in_(piece_ids),
+                ~exists().where(UserLibrary.music_piece_id == MusicPiece.id),
+            )
+        ).scalars()
+    )
+    if not orphan_ids:
+        return 0
+    db.session.execute(
+        delete(PieceDescription).where(
+            PieceDescription.music_piece_id.in_(orphan_ids)
+        )
+    )
+    db.session.execute(delete(MusicPiece).where(MusicPiece.id.in_(orphan_ids)))
+    return len(orphan_ids)
+
+
+# Remove a piece from a user's library and, if that was its last
+# reference, the piece itself. Only the unlinked piece is checked, so the
+# cost doesn't grow with the catalog. Returns False if it wasn't saved.
+def remove_from_library(user_id, piece_id):
+    removed = db.session.execute(
+        delete(UserLibrary).where(
+            UserLibrary.user_id == user_id,
+            UserLibrary.music_piece_id == piece_id,
+        )
+    ).rowcount
+    if removed:
+        delete_if_orphaned([piece_id])
+    db.session.commit()
+    return removed == 1
+
+
+# Sweep the whole catalog for unreferenced pieces (e.g. left by an older
+# version or a failed request), deleting and committing them in batches.
+# Returns the total deleted.
+def collect_orphaned_pieces(batch_size=500, echo=print):
+    deleted = 0
+    after_id = 0
+    while True:
+        batch = list(
+            db.session.execute(
+                select(MusicPiece.id)
+                .where(MusicPiece.id > after_id)
+                .order_by(MusicPiece.id)
+                .limit(batch_size)
+            ).scalars()
+        )
+        if not batch:
+            break
+        after_id = batch[-1]
+        deleted += delete_if_orphaned(batch)
+        db.session.commit()
+        echo(f"Checked pieces up to id {after_id}: {deleted} deleted")
+    return deleted
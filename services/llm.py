@@ -0,0 +1,336 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from flask import current_app
+import hashlib
+import queue
+import threading
+import time
+import google.generativeai as genai
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMTimeout(LLMError):
+    pass
+
+
+class LLMRateLimited(LLMError):
+    pass
+
+
+# Token bucket shared by every LLM call: `rate` tokens per second, up to
+# `capacity` saved up for bursts
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Take a token, waiting up to `timeout` seconds for one. Returns False
+    # straight away if none would be free in time.
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.rate
+            if now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+
+# Rough token estimate for backends that don't report usage
+def estimate_tokens(text):
+    return max(1, len(text or "") // 4)
+
+
+# Gemini through google-generativeai: configured once, with one model
+# instance per model name created on first use
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        if api_key:
+            genai.configure(api_key=api_key)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(api_key=config["GOOGLE_API_KEY"])
+
+    def model(self, model_name):
+        if not self.api_key:
+            raise LLMError("API key not configured")
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = genai.GenerativeModel(model_name)
+            return self._models[model_name]
+
+    # Returns (text, prompt_tokens, output_tokens)
+    def generate(self, model_name, prompt):
+        response = self.model(model_name).generate_content(prompt)
+        text = response.text
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        if not isinstance(prompt_tokens, int):
+            prompt_tokens = estimate_tokens(prompt)
+        if not isinstance(output_tokens, int):
+            output_tokens = estimate_tokens(text)
+        return text, prompt_tokens, output_tokens
+
+    def stream(self, model_name, prompt):
+        response = self.model(model_name).generate_content(prompt, stream=True)
+        for chunk in response:
+            yield chunk.text
+
+
+# Offline backend: the same prompt always gives the same text, after an
+# optional fixed delay standing in for network latency
+class StubBackend:
+    name = "stub"
+
+    def __init__(self, latency=0):
+        self.latency = latency
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(latency=config["LLM_STUB_LATENCY"])
+
+    def text_for(self, model_name, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return (
+            f"[{model_name} stub {digest[:12]}] A fine choice: this piece "
+            "rewards close listening, with memorable themes and a "
+            "character all of its own."
+        )
+
+    def generate(self, model_name, prompt):
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.text_for(model_name, prompt)
+        return text, estimate_tokens(prompt), estimate_tokens(text)
+
+    def stream(self, model_name, prompt):
+        words = self.text_for(model_name, prompt).split(" ")
+        for i, word in enumerate(words):
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            yield word if i == len(words) - 1 else word + " "
+
+
+# LLM_BACKEND name -> backend class, built with from_config(app.config)
+BACKENDS = {"gemini": GeminiBackend, "stub": StubBackend}
+
+
+# App-wide entry point for LLM calls: runs each call on a worker thread
+# so it can be abandoned after `timeout` seconds, and keeps call, latency
+# and token counters. Calls wait up to `queue_timeout` seconds for the
+# rate limiter (if any) unless the caller paces itself and passes
+# rate_limited=False, and concurrent calls with the same model and prompt
+# share one request.
+class LLMGateway:
+    def __init__(
+        self,
+        backend,
+        model_name,
+        timeout=30,
+        max_workers=8,
+        limiter=None,
+        queue_timeout=30,
+    ):
+        self.backend = backend
+        self.model_name = model_name
+        self.timeout = timeout
+        self.limiter = limiter
+        self.queue_timeout = queue_timeout
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="llm"
+        )
+        self._inflight = {}  # (model, prompt) -> Future
+        self._inflight_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+        self.coalesced = 0
+        self.total_latency = 0.0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def _record(self, started, prompt_tokens=0, output_tokens=0, error=None):
+        with self._lock:
+            self.calls += 1
+            self.total_latency += time.monotonic() - started
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+            if isinstance(error, LLMTimeout):
+                self.timeouts += 1
+            elif isinstance(error, LLMRateLimited):
+                self.rate_limited += 1
+            elif error is not None:
+                self.errors += 1
+
+    # Wait for a rate limiter token, raising if the queue deadline passes
+    def _acquire(self):
+        if self.limiter and not self.limiter.acquire(self.queue_timeout):
+            raise LLMRateLimited(
+                f"LLM rate limit: no slot within {self.queue_timeout}s"
+            )
+
+    # One backend call: wait for the rate limiter, then give the call
+    # `timeout` seconds
+    def _call(self, model_name, prompt, timeout, rate_limited=True):
+        started = time.monotonic()
+        try:
+            if rate_limited:
+                self._acquire()
+            future = self._pool.submit(
+                self.backend.generate, model_name, prompt
+            )
+            try:
+                text, prompt_tokens, output_tokens = future.result(timeout)
+            except FutureTimeout:
+                # On Python 3.11+ this is also the builtin TimeoutError,
+                # which the backend itself may have raised
+                if future.done():
+                    raise
+                raise LLMTimeout(f"LLM call timed out after {timeout}s")
+        except Exception as e:
+            self._record(started, error=e)
+            raise
+        self._record(started, prompt_tokens, output_tokens)
+        return text
+
+    def generate(
+        self, prompt, model_name=None, timeout=None, rate_limited=True
+    ):
+        model_name = model_name or self.model_name
+        timeout = self.timeout if timeout is None else timeout
+        key = (model_name, prompt)
+
+        # Join an identical call that is already in flight
+        with self._inflight_lock:
+            shared = self._inflight.get(key)
+            leader = shared is None
+            if leader:
+                shared = Future()
+                self._inflight[key] = shared
+
+        if not leader:
+            with self._lock:
+                self.coalesced += 1
+            try:
+                return shared.result(self.queue_timeout + timeout)
+            except FutureTimeout:
+                if shared.done():
+                    raise
+                raise LLMTimeout(f"LLM call timed out after {timeout}s")
+
+        try:
+            text = self._call(model_name, prompt, timeout, rate_limited)
+        except Exception as e:
+            shared.set_exception(e)
+            raise
+        else:
+            shared.set_result(text)
+            return text
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    # Yield text chunks as they arrive. `timeout` bounds the wait for
+    # each chunk rather than the whole stream.
+    def stream(self, prompt, model_name=None, timeout=None):
+        model_name = model_name or self.model_name
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        chunks = queue.Queue()
+        done = object()
+
+        def produce():
+            try:
+                self._acquire()
+                for text in self.backend.stream(model_name, prompt):
+                    chunks.put(text)
+                chunks.put(done)
+            except Exception as e:
+                chunks.put(e)
+
+        self._pool.submit(produce)
+        output = []
+        while True:
+            # The first chunk may also have to wait for the rate limiter
+            wait = timeout if output else self.queue_timeout + timeout
+            try:
+                item = chunks.get(timeout=wait)
+            except queue.Empty:
+                error = LLMTimeout(f"LLM stream stalled for {timeout}s")
+                self._record(started, error=error)
+                raise error
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                self._record(started, error=item)
+                raise item
+            output.append(item)
+            yield item
+        self._record(
+            started, estimate_tokens(prompt), estimate_tokens("".join(output))
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "model": self.model_name,
+                "calls": self.calls,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "rate_limited": self.rate_limited,
+                "coalesced": self.coalesced,
+                "avg_latency": (
+                    self.total_latency / self.calls if self.calls else 0.0
+                ),
+                "prompt_tokens": self.prompt_tokens,
+                "output_tokens": self.output_tokens,
+            }
+
+
+# Build the gateway described by the app config
+def create_gateway(config):
+    backend_name = config["LLM_BACKEND"]
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {backend_name}")
+    backend = BACKENDS[backend_name].from_config(config)
+    limiter = None
+    if config["LLM_RPM"]:
+        limiter = TokenBucket(config["LLM_RPM"] / 60.0, config["LLM_BURST"])
+    return LLMGateway(
+        backend,
+        model_name=config["LLM_MODEL"],
+        timeout=config["LLM_TIMEOUT"],
+        max_workers=config["LLM_WORKERS"],
+        limiter=limiter,
+        queue_timeout=config["LLM_QUEUE_TIMEOUT"],
+    )
+
+
+# The app's shared LLM gateway
+def get_llm():
+    return current_app.extensions["llm"]
@@ -0,0 +1,107 @@
+from sqlalchemy import text
+from database import db
+from models.composer import Composer
+from models.description import PieceDescription
+from models.suggestion import WeatherSuggestion
+from models.work import Work
+from services import fulltext
+from services.catalog import utcnow
+
+
+# Tables added since the original schema, created by migration 3 on
+# databases that predate them
+def create_new_tables(connection):
+    db.metadata.create_all(
+        connection,
+        tables=[
+            Composer.__table__,
+            Work.__table__,
+            WeatherSuggestion.__table__,
+            PieceDescription.__table__,
+        ],
+        checkfirst=True,
+    )
+    connection.execute(text(fulltext.CREATE_FTS_TABLE.statement))
+
+
+# Forward-only schema migrations, applied in version order. Never edit or
+# renumber one that has shipped; add a new version instead. Each step is
+# an SQL string or a function taking the connection, and must be safe on
+# a database created by create_all from current models.
+MIGRATIONS = [
+    (
+        1,
+        "Index user_library.music_piece_id",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_user_library_music_piece_id "
+            "ON user_library (music_piece_id)",
+        ],
+    ),
+    (
+        2,
+        "Index music_pieces by genre and composer",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_music_pieces_genre_composer "
+            "ON music_pieces (genre, composer)",
+        ],
+    ),
+    (
+        3,
+        "Create catalog, weather suggestion and description tables",
+        [create_new_tables],
+    ),
+]
+
+SCHEMA_MIGRATIONS_DDL = (
+    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+    "version INTEGER PRIMARY KEY, "
+    "name VARCHAR(200) NOT NULL, "
+    "applied_at DATETIME NOT NULL)"
+)
+
+
+# Versions already recorded in schema_migrations
+def applied_versions(connection):
+    connection.execute(text(SCHEMA_MIGRATIONS_DDL))
+    return {
+        version
+        for (version,) in connection.execute(
+            text("SELECT version FROM schema_migrations")
+        )
+    }
+
+
+def record(connection, version, name):
+    connection.execute(
+        text(
+            "INSERT INTO schema_migrations (version, name, applied_at) "
+            "VALUES (:version, :name, :applied_at)"
+        ),
+        {"version": version, "name": name, "applied_at": utcnow()},
+    )
+
+
+# Migrations not yet applied, as (version, name, statements)
+def pending_migrations():
+    with db.engine.begin() as connection:
+        applied = applied_versions(connection)
+    return [
+        migration for migration in MIGRATIONS if migration[0] not in applied
+    ]
+
+
+# Apply pending migrations in order, each in its own transaction together
+# with its schema_migrations row. Returns the versions applied.
+def migrate(echo=print):
+    applied = []
+    for version, name, statements in pending_migrations():
+        with db.engine.begin() as connection:
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(text(statement))
+            record(connection, version, name)
+        echo(f"Applied migration {version}: {name}")
+        applied.append(version)
+    return applied
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+
+OPENOPUS_URL = "https://api.openopus.org"
+
+
+# Fetch the full composer list
+def fetch_all_composers(http, timeout=None):
+    data = http.get_json(
+        f"{OPENOPUS_URL}/composer/list/name/all.json", timeout=timeout
+    )
+    return data.get("composers", [])
+
+
+# Fetch every work of a single composer, or None if the request fails
+def fetch_composer_works(http, composer_id, timeout=None):
+    works_url = (
+        f"{OPENOPUS_URL}/work/list/composer/{composer_id}/genre/all.json"
+    )
+    response = http.get(works_url, timeout=timeout)
+    if response.status_code != 200:
+        return None
+    return response.json().get("works", []) or []
+
+
+# Fetch works for many composers concurrently, keeping the input order.
+# Returns one entry per composer id: a list of works, or None if that
+# composer failed or did not finish before the deadline.
+def fetch_works_concurrently(http, composer_ids, max_workers=8, deadline=10.0):
+    if not composer_ids:
+        return []
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(composer_ids)))
+    )
+    try:
+        futures = [
+            executor.submit(
+                fetch_composer_works, http, composer_id, timeout=deadline
+            )
+            for composer_id in composer_ids
+        ]
+        wait(futures, timeout=deadline)
+
+        results = []
+        for composer_id, future in zip(composer_ids, futures):
+            if not future.done():
+                print(f"Timed out fetching works for composer {composer_id}")
+                results.append(None)
+                continue
+            try:
+                results.append(future.result())
+            except (requests.RequestException, ValueError) as e:
+                print(f"Error fetching works for composer {composer_id}: {e}")
+                results.append(None)
+        return results
+    finally:
+        # Don't hold the caller for stragglers past the deadline
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,84 @@
+from datetime import timedelta
+import hashlib
+import math
+import random
+from database import db
+from models.suggestion import WeatherSuggestion
+from services.catalog import utcnow
+from services.llm import get_llm
+
+
+# Normalised cache key: condition text, temperature bucket, composers and
+# the place name the prompt mentions
+def suggestion_key(
+    weather_desc, temp, composer_names, bucket_size=5, place=""
+):
+    condition = " ".join((weather_desc or "").lower().split())
+    bucket = math.floor(float(temp or 0) / bucket_size) * bucket_size
+    composers = "|".join(sorted(name or "" for name in composer_names))
+    place = " ".join((place or "").lower().split())
+    raw = f"{condition}:{bucket}:{composers}:{place}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# A random fresh suggestion for the key (None if there isn't one) and how
+# many fresh variants the key has
+def cached_suggestion(cache_key, ttl):
+    fresh = (
+        WeatherSuggestion.query.filter(
+            WeatherSuggestion.cache_key == cache_key,
+            WeatherSuggestion.created_at >= utcnow() - timedelta(seconds=ttl),
+        )
+        .with_entities(WeatherSuggestion.text)
+        .all()
+    )
+    if not fresh:
+        return None, 0
+    return random.choice(fresh).text, len(fresh)
+
+
+# Save a new suggestion, keeping only the newest max_variants for the key.
+# Suggestions older than ttl seconds under any key are deleted too, so
+# keys that are never seen again don't pile up.
+def store_suggestion(cache_key, text, max_variants, ttl):
+    now = utcnow()
+    WeatherSuggestion.query.filter(
+        WeatherSuggestion.created_at < now - timedelta(seconds=ttl)
+    ).delete(synchronize_session=False)
+    db.session.add(
+        WeatherSuggestion(cache_key=cache_key, text=text, created_at=now)
+    )
+    db.session.flush()
+
+    stale_ids = [
+        suggestion_id
+        for (suggestion_id,) in WeatherSuggestion.query.filter_by(
+            cache_key=cache_key
+        )
+        .order_by(
+            WeatherSuggestion.created_at.desc(), WeatherSuggestion.id.desc()
+        )
+        .offset(max_variants)
+        .with_entities(WeatherSuggestion.id)
+    ]
+    if stale_ids:
+        WeatherSuggestion.query.filter(
+            WeatherSuggestion.id.in_(stale_ids)
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+
+# Background job: ask the LLM for a suggestion and cache it under the key.
+# When streaming, each chunk is published on the job as it arrives.
+def generate_suggestion(
+    job, cache_key, prompt, max_variants, ttl, stream=False
+):
+    llm = get_llm()
+    if stream:
+        for text in llm.stream(prompt):
+            job.add_chunk(text)
+        suggestion = "".join(job.chunks)
+    else:
+        suggestion = llm.generate(prompt)
+    store_suggestion(cache_key, suggestion, max_variants, ttl)
+    return suggestion
@@ -0,0 +1,97 @@
+from bisect import bisect_left
+import threading
+import time
+import unicodedata
+from database import db
+from models.composer import Composer
+from services.catalog import catalog_version
+
+
+# Lowercase and strip accents so "dvo" matches "Dvořák"
+def fold(text):
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return stripped.casefold()
+
+
+# In-memory prefix index over composer names, built from the local catalog.
+# Only composers whose works have been synced are offered, as searches
+# skip the rest (see composer_names). Every composer is reachable by a prefix of their full name or of any
+# word in it, so "moz" and "wolfgang" both find Mozart. Lookups are a
+# bisect into a sorted key list and a short forward scan.
+class ComposerPrefixIndex:
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+
+        self._keys = []  # sorted (folded key, composer id)
+        self._composers = {}  # composer id -> JSON-ready dict
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self):
+        with self._lock:
+            self._version = None
+            self._checked_at = 0.0
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.refresh_interval:
+            return
+        version = catalog_version()
+        if version != self._version:
+            self._build(version)
+        self._checked_at = now
+
+    def _build(self, version):
+        keys = []
+        composers = {}
+        rows = db.session.execute(
+            db.select(
+                Composer.id,
+                Composer.name,
+                Composer.complete_name,
+                Composer.epoch,
+            ).where(Composer.works_synced_at.is_not(None))
+        )
+        for composer_id, name, complete_name, epoch in rows:
+            composers[composer_id] = {
+                "id": composer_id,
+                "name": name,
+                "complete_name": complete_name,
+                "epoch": epoch,
+            }
+            full_name = fold(complete_name)
+            words = set(full_name.split()) | set(fold(name).split())
+            keys.append((full_name, composer_id))
+            keys.extend((word, composer_id) for word in words)
+        keys.sort()
+
+        with self._lock:
+            self._keys = keys
+            self._composers = composers
+            self._version = version
+
+    # Up to limit composers whose name or any name word starts with prefix
+    def search(self, prefix, limit=10):
+        self._check_version()
+        folded = fold(prefix).strip()
+        if not folded:
+            return []
+
+        with self._lock:
+            keys = self._keys
+            composers = self._composers
+
+        matches = []
+        seen = set()
+        for key, composer_id in keys[bisect_left(keys, (folded,)) :]:
+            if not key.startswith(folded):
+                break
+            if composer_id in seen:
+                continue
+            seen.add(composer_id)
+            matches.append(composers[composer_id])
+            if len(matches) >= limit:
+                break
+        return matches
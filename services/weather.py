@@ -0,0 +1,35 @@
+from urllib.parse import urlencode
+
+WEATHER_URL = "http://api.weatherapi.com/v1/current.json"
+
+# Decimal places kept for "lat,lon" locations (1 ≈ 11 km)
+COORDINATE_PRECISION = 1
+
+
+# Canonical cache key for a location: rounded "lat,lon" for coordinates,
+# otherwise the place name lowercased with whitespace collapsed. Returns
+# None for empty input.
+def normalise_location(value):
+    value = " ".join((value or "").split())
+    if not value:
+        return None
+
+    parts = [part.strip() for part in value.split(",")]
+    if len(parts) == 2:
+        try:
+            lat, lon = float(parts[0]), float(parts[1])
+        except ValueError:
+            pass
+        else:
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                lat = round(lat, COORDINATE_PRECISION) + 0.0
+                lon = round(lon, COORDINATE_PRECISION) + 0.0
+                return f"{lat:.{COORDINATE_PRECISION}f},{lon:.{COORDINATE_PRECISION}f}"
+
+    return value.casefold()
+
+
+# WeatherAPI current-conditions URL for a canonical location key
+def weather_url(api_key, location):
+    query = urlencode({"key": api_key, "q": location, "aqi": "no"})
+    return f"{WEATHER_URL}?{query}"
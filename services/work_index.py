@@ -0,0 +1,220 @@
+from collections import OrderedDict
+import sys
+import threading
+import time
+from database import db
+from models.work import Work
+from services.catalog import catalog_version, composer_names
+
+
+# Compact, read-only record for one work. Strings are interned so repeated
+# genres, composer names and common titles share a single object.
+class WorkRecord:
+    __slots__ = (
+        "title",
+        "subtitle",
+        "genre",
+        "composer_name",
+        "composer_id",
+        "flags",
+    )
+
+    POPULAR = 1
+    RECOMMENDED = 2
+
+    def __init__(
+        self, title, subtitle, genre, composer_name, composer_id, flags
+    ):
+        self.title = sys.intern(title)
+        self.subtitle = sys.intern(subtitle)
+        self.genre = sys.intern(genre)
+        self.composer_name = composer_name
+        self.composer_id = composer_id
+        self.flags = flags
+
+    @property
+    def popular(self):
+        return bool(self.flags & self.POPULAR)
+
+    @property
+    def recommended(self):
+        return bool(self.flags & self.RECOMMENDED)
+
+    # Dict-style access so templates can treat records like result dicts
+    def __getitem__(self, key):
+        if key not in self.__slots__ and key not in ("popular", "recommended"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return {
+            "title": self.title,
+            "subtitle": self.subtitle,
+            "genre": self.genre,
+            "popular": self.popular,
+            "recommended": self.recommended,
+            "composer_name": self.composer_name,
+            "composer_id": self.composer_id,
+        }
+
+    def size(self):
+        return (
+            sys.getsizeof(self)
+            + sys.getsizeof(self.title)
+            + sys.getsizeof(self.subtitle)
+        )
+
+
+# Process-wide index of works keyed by composer id and genre. Composers are
+# loaded from the catalog on first use and evicted least recently used
+# first once the estimated size passes max_bytes. The index drops itself
+# when the catalog version changes (checked every refresh_interval seconds)
+# or when reload() is called.
+class WorkIndex:
+    def __init__(self, max_bytes=64 * 1024 * 1024, refresh_interval=60):
+        self.max_bytes = max_bytes
+        self.refresh_interval = refresh_interval
+
+        # composer_id -> (composer_name, {genre: tuple of WorkRecord}, size)
+        self._composers = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+
+    def reload(self):
+        with self._lock:
+            self._composers.clear()
+            self._bytes = 0
+            self._version = None
+            self.reloads += 1
+
+    # Catalog version the index is currently serving
+    def version(self):
+        self._check_version()
+        with self._lock:
+            return self._version
+
+    # Works for the given composers and genres, grouped per composer in the
+    # order requested. Unknown or unsynced composers are left out.
+    def lookup(self, composer_ids, genres):
+        self._check_version()
+
+        with self._lock:
+            missing = [
+                composer_id
+                for composer_id in composer_ids
+                if composer_id not in self._composers
+            ]
+            self.hits += len(composer_ids) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            self._load(missing)
+
+        results = []
+        with self._lock:
+            for composer_id in composer_ids:
+                entry = self._composers.get(composer_id)
+                if entry is None:
+                    continue
+                self._composers.move_to_end(composer_id)
+                name, by_genre, _ = entry
+                works = []
+                for genre in genres:
+                    works.extend(by_genre.get(genre, ()))
+                results.append((composer_id, name, works))
+        return results
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.refresh_interval:
+            return
+        version = catalog_version()
+        with self._lock:
+            self._checked_at = now
+            if version != self._version:
+                if self._version is not None:
+                    self.reloads += 1
+                self._composers.clear()
+                self._bytes = 0
+                self._version = version
+
+    def _load(self, composer_ids):
+        names = composer_names(composer_ids)
+        if not names:
+            return
+
+        by_composer = {composer_id: {} for composer_id in names}
+        sizes = dict.fromkeys(names, 0)
+        rows = db.session.execute(
+            db.select(
+                Work.composer_id,
+                Work.title,
+                Work.subtitle,
+                Work.genre,
+                Work.popular,
+                Work.recommended,
+            )
+            .where(Work.composer_id.in_(list(names)))
+            .order_by(Work.id)
+        )
+        for composer_id, title, subtitle, genre, popular, recommended in rows:
+            flags = (WorkRecord.POPULAR if popular else 0) | (
+                WorkRecord.RECOMMENDED if recommended else 0
+            )
+            record = WorkRecord(
+                title,
+                subtitle or "",
+                genre,
+                names[composer_id],
+                str(composer_id),
+                flags,
+            )
+            by_composer[composer_id].setdefault(record.genre, []).append(
+                record
+            )
+            sizes[composer_id] += record.size()
+
+        with self._lock:
+            for composer_id, genres in by_composer.items():
+                if composer_id in self._composers:
+                    continue
+                entry = (
+                    sys.intern(names[composer_id]),
+                    {genre: tuple(works) for genre, works in genres.items()},
+                    sizes[composer_id],
+                )
+                self._composers[composer_id] = entry
+                self._bytes += entry[2]
+            self._evict()
+
+    def _evict(self):
+        # Always keep the most recent composer, even if it alone is too big
+        while self._bytes > self.max_bytes and len(self._composers) > 1:
+            _, (_, _, size) = self._composers.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "composers": len(self._composers),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+            }
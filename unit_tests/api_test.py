@@ -0,0 +1,197 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from datetime import datetime
+from app import create_app
+from database import db
+from models.composer import Composer
+from models.work import Work
+from services import fulltext
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    test_app.extensions["work_index"].refresh_interval = 0
+    with test_app.app_context():
+        db.session.add(
+            Composer(
+                id=1,
+                name="Mozart",
+                complete_name="Wolfgang Amadeus Mozart",
+                works_synced_at=datetime(2024, 1, 1),
+            )
+        )
+        db.session.add_all(
+            [
+                Work(composer_id=1, title="Requiem", genre="Choral"),
+                Work(composer_id=1, title="Don Giovanni", genre="Opera"),
+                Work(
+                    composer_id=1,
+                    title="Piano Sonata No. 11",
+                    subtitle="Alla Turca",
+                    genre="Keyboard",
+                ),
+            ]
+        )
+        db.session.add(
+            Composer(
+                id=3,
+                name="Dvořák",
+                complete_name="Antonín Dvořák",
+                epoch="Romantic",
+            )
+        )
+        db.session.commit()
+        fulltext.rebuild()
+    test_app.extensions["composer_index"].refresh_interval = 0
+    return test_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Test the works endpoint filters like /search
+def test_works_api(client):
+    response = client.get("/api/works?composer_id=1&genre=Choral")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [work["title"] for work in data["works"]] == ["Requiem"]
+    assert data["composers"][0]["name"] == "Wolfgang Amadeus Mozart"
+    assert response.headers["ETag"]
+    assert "public" in response.headers["Cache-Control"]
+
+
+# Test the works endpoint validates its query
+def test_works_api_validation(client):
+    assert client.get("/api/works?genre=Choral").status_code == 400
+    assert client.get("/api/works?composer_id=1").status_code == 400
+
+
+# Test composer ids too large for SQLite are dropped like invalid ones
+def test_works_api_oversized_composer_id(client):
+    url = "/api/works?composer_id=99999999999999999999&genre=Choral"
+    assert client.get(url).status_code == 400
+
+    response = client.get(url + "&composer_id=1")
+    assert response.status_code == 200
+    assert [w["title"] for w in response.get_json()["works"]] == ["Requiem"]
+
+
+# Test conditional GETs answer 304 until the catalog changes
+def test_works_api_conditional_get(app, client):
+    url = "/api/works?composer_id=1&genre=Choral"
+    etag = client.get(url).headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    with app.app_context():
+        db.session.get(Composer, 1).works_synced_at = datetime(2024, 2, 1)
+        db.session.commit()
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+# Test a weak validator (e.g. from a compressing proxy) still gets a 304,
+# which carries the same caching headers as the full response
+def test_works_api_conditional_get_weak_etag(client):
+    url = "/api/works?composer_id=1&genre=Choral"
+    full = client.get(url)
+    etag = full.headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.headers["Cache-Control"] == full.headers["Cache-Control"]
+
+
+# Test full-text search matches titles, subtitles and composer names
+def test_search_api(client):
+    data = client.get("/api/search?q=turca").get_json()
+    assert data["total"] == 1
+    assert data["works"][0]["title"] == "Piano Sonata No. 11"
+
+    data = client.get("/api/search?q=don gio").get_json()
+    assert [work["title"] for work in data["works"]] == ["Don Giovanni"]
+
+    data = client.get("/api/search?q=Amadeus&per_page=2").get_json()
+    assert data["total"] == 3
+    assert len(data["works"]) == 2
+
+
+# Test a huge page number gives an empty page instead of an error
+def test_search_api_page_out_of_range(app, client):
+    response = client.get("/api/search?q=Amadeus&page=99999999999999999999")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["page"] == app.config["API_SEARCH_MAX_PAGE"]
+    assert data["total"] == 3
+    assert data["works"] == []
+
+
+# Test titles outrank composer-name-only matches, and bad input is safe
+def test_search_api_ranking_and_validation(app, client):
+    with app.app_context():
+        db.session.add(
+            Composer(id=2, name="Requiem", complete_name="Requiem Composer")
+        )
+        db.session.add(Work(composer_id=2, title="Etude", genre="Keyboard"))
+        db.session.commit()
+        fulltext.rebuild()
+
+    data = client.get("/api/search?q=requiem").get_json()
+    assert [work["title"] for work in data["works"]] == ["Requiem", "Etude"]
+
+    assert client.get("/api/search").status_code == 400
+    data = client.get('/api/search?q=" OR *').get_json()
+    assert data["total"] == 0
+
+
+# Test composer autocomplete matches any name word, ignoring accents, and
+# only offers composers whose works have been synced
+def test_composers_api(app, client):
+    assert client.get("/api/composers?q=dvor").get_json()["composers"] == []
+
+    with app.app_context():
+        db.session.get(Composer, 3).works_synced_at = datetime(2024, 1, 2)
+        db.session.commit()
+
+    data = client.get("/api/composers?q=dvor").get_json()
+    assert [c["complete_name"] for c in data["composers"]] == [
+        "Antonín Dvořák"
+    ]
+
+    data = client.get("/api/composers?q=ANTON").get_json()
+    assert data["composers"][0]["id"] == 3
+
+    data = client.get("/api/composers?q=wolf").get_json()
+    assert data["composers"][0]["name"] == "Mozart"
+
+    assert client.get("/api/composers?q=").get_json()["composers"] == []
+    assert client.get("/api/composers?q=zzz").get_json()["composers"] == []
+
+
+# Test autocomplete picks up newly synced composers
+def test_composers_api_reloads(app, client):
+    assert client.get("/api/composers?q=bach").get_json()["composers"] == []
+    with app.app_context():
+        db.session.add(
+            Composer(
+                id=4,
+                name="Bach",
+                complete_name="Johann Sebastian Bach",
+                works_synced_at=datetime(2024, 3, 1),
+            )
+        )
+        db.session.commit()
+    data = client.get("/api/composers?q=bach").get_json()
+    assert data["composers"][0]["id"] == 4
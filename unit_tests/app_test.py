@@ -3,6 +3,8 @@ import os
 import pytest
 import requests_mock
 from app import create_app
+from database import db
+from models.composer import Composer
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -28,7 +30,11 @@ def test_root_route(client):
 
 
 # Test form route ("/form")
-def test_form_route_basic(client):
+def test_form_route_basic(app, client):
+    with app.app_context():
+        db.session.add(Composer(id=1, name="Bach", complete_name="Bach"))
+        db.session.commit()
+
     response = client.get("/form")
     assert response.status_code == 200
 
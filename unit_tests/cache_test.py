@@ -0,0 +1,108 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import pytest
+from unittest.mock import Mock
+from services.cache import ResponseCache
+from services.http import redact
+
+
+# Test repeat lookups are served from the cache
+def test_cache_hit_and_miss():
+    fetch = Mock(return_value={"composers": []})
+    cache = ResponseCache(fetch=fetch)
+
+    assert cache.get("https://api.openopus.org/a.json") == {"composers": []}
+    assert cache.get("https://api.openopus.org/a.json") == {"composers": []}
+
+    assert fetch.call_count == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+# Test the least recently used entry is evicted first
+def test_cache_lru_eviction():
+    cache = ResponseCache(fetch=lambda url: url, max_entries=2)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    cache.get("c")
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+    cache.get("a")
+    assert cache.stats()["hits"] == 2
+
+
+# Test the longest matching URL prefix picks the TTL
+def test_cache_ttl_for_prefix():
+    cache = ResponseCache(
+        fetch=lambda url: url,
+        default_ttl=5,
+        ttls={"http://api.example.com/": 10, "http://api.example.com/v1/": 20},
+    )
+    assert cache.ttl_for("http://other.com/") == 5
+    assert cache.ttl_for("http://api.example.com/x") == 10
+    assert cache.ttl_for("http://api.example.com/v1/x") == 20
+
+
+# Test expired entries are served stale while one refresh runs
+def test_cache_stale_while_revalidate():
+    release = threading.Event()
+    values = iter(["old", "new"])
+
+    def fetch(url):
+        value = next(values)
+        if value == "new":
+            release.wait(timeout=5)
+        return value
+
+    cache = ResponseCache(fetch=fetch, default_ttl=0)
+    assert cache.get("a") == "old"
+
+    # Both lookups get the stale copy and start only one refresh
+    assert cache.get("a") == "old"
+    assert cache.get("a") == "old"
+    assert cache.stats()["stale_hits"] == 2
+
+    release.set()
+    for _ in range(100):
+        if not cache._refreshing:
+            break
+        threading.Event().wait(0.01)
+    assert cache._entries["a"][0] == "new"
+
+
+# Test an entry too far past expiry is refetched in the foreground rather
+# than served stale
+def test_cache_max_stale():
+    fetch = Mock(side_effect=["old", "new"])
+    cache = ResponseCache(fetch=fetch, default_ttl=0, max_stale=0)
+    assert cache.get("a") == "old"
+    assert cache.get("a") == "new"
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["stale_hits"] == 0
+
+
+# Test logged URLs and errors leave out query strings such as API keys
+def test_redact_drops_query_strings():
+    url = "http://api.weatherapi.com/v1/current.json?key=secret&q=london"
+    assert redact(url) == "http://api.weatherapi.com/v1/current.json"
+    error = (
+        "Max retries exceeded with url: /v1/current.json?key=secret&q=x "
+        f"(404 for url: {url})"
+    )
+    assert "secret" not in redact(error)
+
+
+# Test failed fetches are not cached
+def test_cache_does_not_store_errors():
+    fetch = Mock(side_effect=ValueError("bad json"))
+    cache = ResponseCache(fetch=fetch)
+
+    with pytest.raises(ValueError):
+        cache.get("a")
+    assert cache.stats()["entries"] == 0
@@ -5,13 +5,22 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import pytest
+from datetime import timedelta
 from flask import Flask
 from database import db
 from models.musicpiece import MusicPiece
+from models.suggestion import WeatherSuggestion
 from models.user import User
 from models.userlibrary import UserLibrary
 from cli import create_all, drop_all, populate
-from sqlalchemy import inspect
+from services.suggestions import (
+    cached_suggestion,
+    store_suggestion,
+    suggestion_key,
+)
+from services import migrations
+from services.catalog import utcnow
+from sqlalchemy import inspect, text
 
 
 @pytest.fixture
@@ -208,3 +217,109 @@ def test_delete_music_piece(app):
         # Verify the music piece is deleted from the database
         deleted_piece = db.session.get(MusicPiece, piece.id)
         assert deleted_piece is None
+
+
+def test_suggestion_cache_keeps_newest_variants(app):
+    """Test cached weather suggestions are capped per key and expire."""
+    with app.app_context():
+        key = suggestion_key("Sunny", 22, ["Mozart", "Bach"])
+        assert key == suggestion_key(" sunny ", 24, ["Bach", "Mozart"])
+        assert key != suggestion_key("Sunny", 25, ["Bach", "Mozart"])
+
+        for text in ["one", "two", "three"]:
+            store_suggestion(key, text, max_variants=2, ttl=60)
+
+        suggestion, variants = cached_suggestion(key, ttl=60)
+        assert suggestion in {"two", "three"}
+        assert variants == 2
+        assert cached_suggestion(key, ttl=-1) == (None, 0)
+
+
+def test_store_suggestion_purges_expired_rows(app):
+    """Test saving a suggestion deletes expired ones under every key."""
+    with app.app_context():
+        old_key = suggestion_key("Fog", 3, ["Satie"], place="oslo")
+        db.session.add(
+            WeatherSuggestion(
+                cache_key=old_key,
+                text="Gymnopédie",
+                created_at=utcnow() - timedelta(hours=4),
+            )
+        )
+        db.session.commit()
+
+        key = suggestion_key("Sunny", 22, ["Mozart"], place="rome")
+        store_suggestion(key, "Eine kleine Nachtmusik", 3, ttl=3 * 60 * 60)
+
+        assert WeatherSuggestion.query.count() == 1
+        assert cached_suggestion(key, ttl=60)[0] == "Eine kleine Nachtmusik"
+
+
+# Tables and indexes added after the original schema
+NEW_TABLES = [
+    "composers",
+    "works",
+    "works_fts",
+    "weather_suggestions",
+    "piece_descriptions",
+]
+NEW_INDEXES = [
+    "ix_user_library_music_piece_id",
+    "ix_music_pieces_genre_composer",
+]
+
+
+def make_old_schema():
+    """Turn the current schema back into one that predates the series."""
+    with db.engine.begin() as connection:
+        for index in NEW_INDEXES:
+            connection.execute(text(f"DROP INDEX {index}"))
+        for table in reversed(NEW_TABLES):
+            connection.execute(text(f"DROP TABLE {table}"))
+
+
+def schema_names():
+    """Names of the tables and indexes in the database."""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    indexes = {
+        index["name"]
+        for table in ("user_library", "music_pieces")
+        for index in inspector.get_indexes(table)
+    }
+    return tables, indexes
+
+
+def test_migrate_adds_indexes(app):
+    """Test migrations bring an older schema up to date, once."""
+    with app.app_context():
+        make_old_schema()
+
+        assert migrations.migrate(echo=lambda message: None) == [1, 2, 3]
+        tables, indexes = schema_names()
+        assert set(NEW_TABLES) <= tables
+        assert set(NEW_INDEXES) <= indexes
+
+        assert migrations.migrate() == []
+        assert migrations.pending_migrations() == []
+
+
+def test_migrations_are_safe_on_new_schema(app):
+    """Test migrations run cleanly on a schema built by create_all."""
+    with app.app_context():
+        assert migrations.migrate(echo=lambda message: None) == [1, 2, 3]
+        assert migrations.pending_migrations() == []
+
+
+def test_create_all_upgrades_existing_database(app):
+    """Test create_all on an existing database also adds new indexes."""
+    with app.app_context():
+        make_old_schema()
+
+    result = app.test_cli_runner().invoke(create_all)
+    assert result.exit_code == 0
+    with app.app_context():
+        tables, indexes = schema_names()
+        assert set(NEW_TABLES) <= tables
+        assert set(NEW_INDEXES) <= indexes
+        assert migrations.pending_migrations() == []
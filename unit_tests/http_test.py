@@ -0,0 +1,54 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import requests
+import requests_mock
+from app import create_app
+from services.http import HttpClient
+
+
+# Test the client applies its default timeouts
+def test_http_client_default_timeout():
+    client = HttpClient(connect_timeout=1, read_timeout=2)
+    with requests_mock.Mocker() as mock:
+        mock.get("https://example.com/a.json", json={"ok": True})
+        assert client.get_json("https://example.com/a.json") == {"ok": True}
+        assert mock.last_request.timeout == (1, 2)
+
+
+# Test retries are limited to idempotent methods
+def test_http_client_retry_policy():
+    client = HttpClient(retries=2, backoff_factor=0.5)
+    retry = client.adapter.max_retries
+    assert retry.total == 2
+    assert retry.backoff_factor == 0.5
+    assert "GET" in retry.allowed_methods
+    assert "POST" not in retry.allowed_methods
+
+
+# Test request and error counters
+def test_http_client_stats():
+    client = HttpClient()
+    with requests_mock.Mocker() as mock:
+        mock.get("https://example.com/ok", text="ok")
+        mock.get(
+            "https://example.com/down", exc=requests.exceptions.ConnectTimeout
+        )
+        client.get("https://example.com/ok")
+        with pytest.raises(requests.RequestException):
+            client.get("https://example.com/down")
+
+    stats = client.stats()
+    assert stats["requests"] == 2
+    assert stats["errors"] == 1
+
+
+# Test the app exposes one shared client and its stats
+def test_app_shares_http_client():
+    app = create_app(testing=True)
+    assert isinstance(app.extensions["http"], HttpClient)
+    response = app.test_client().get("/stats")
+    assert "pools" in response.get_json()["http"]
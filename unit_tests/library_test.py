@@ -0,0 +1,543 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import io
+import json
+from datetime import datetime
+import re
+import threading
+import pytest
+from sqlalchemy import event
+from unittest.mock import Mock, patch
+from app import create_app
+from cli import (
+    gc_orphaned_pieces,
+    import_library,
+    invalidate_descriptions,
+    pregenerate_descriptions,
+)
+from database import db
+from models.description import PieceDescription
+from models.musicpiece import MusicPiece
+from models.user import User
+from models.userlibrary import UserLibrary
+from services import descriptions
+from services.llm import StubBackend, TokenBucket
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    with test_app.app_context():
+        user = User(username="alice")
+        piece = MusicPiece(
+            composer="Ludwig van Beethoven",
+            title="Piano Sonata No. 14",
+            subtitle="Moonlight",
+            genre="Keyboard",
+            popular=True,
+            recommended=True,
+        )
+        db.session.add_all([user, piece])
+        db.session.flush()
+        db.session.add(UserLibrary(user_id=user.id, music_piece_id=piece.id))
+        db.session.commit()
+    return test_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Mock Gemini model returning the given text, optionally in chunks
+def mock_model(text, chunks=None):
+    model = Mock()
+    model.generate_content.side_effect = lambda prompt, stream=False: (
+        [Mock(text=chunk) for chunk in chunks] if stream else Mock(text=text)
+    )
+    return model
+
+
+# Test the piece page includes the generated description
+def test_single_piece_description(client):
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_genai.return_value = mock_model("A nocturnal masterpiece.")
+        response = client.get("/library/1?user_name=alice")
+
+    assert response.status_code == 200
+    assert b"A nocturnal masterpiece." in response.data
+
+
+# Test streaming mode defers the description to the SSE endpoint
+def test_single_piece_streamed_description(client):
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_genai.return_value = mock_model(
+            None, ["A noct", "urnal ", "gem."]
+        )
+        page = client.get("/library/1?user_name=alice&stream=1")
+        assert mock_genai.return_value.generate_content.call_count == 0
+        assert b"EventSource" in page.data
+
+        response = client.get("/library/1/description/stream?user_name=alice")
+        body = response.get_data()
+
+    assert response.mimetype == "text/event-stream"
+    assert body.count(b"event: chunk") == 3
+    assert b'"urnal "' in body
+    assert body.rstrip().endswith(b"event: done\ndata: {}")
+
+
+# Test the stream endpoint checks the piece is in the user's library
+def test_stream_description_unknown_piece(client):
+    response = client.get("/library/99/description/stream?user_name=alice")
+    assert response.status_code == 404
+
+
+# Test a generated description is stored and served on later views
+def test_piece_description_is_stored(app, client):
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_genai.return_value = mock_model("A nocturnal masterpiece.")
+        client.get("/library/1?user_name=alice")
+        response = client.get("/library/1?user_name=alice&stream=1")
+        assert mock_genai.return_value.generate_content.call_count == 1
+
+    assert b"A nocturnal masterpiece." in response.data
+    assert b"EventSource" not in response.data
+    with app.app_context():
+        stored = db.session.get(PieceDescription, 1)
+        assert stored.model == "gemini:gemini-pro"
+        assert stored.prompt_version == descriptions.PROMPT_VERSION
+
+
+# Test a streamed description is stored once complete
+def test_streamed_description_is_stored(client):
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_genai.return_value = mock_model(None, ["Moon", "light."])
+        client.get("/library/1/description/stream?user_name=alice").get_data()
+        body = client.get(
+            "/library/1/description/stream?user_name=alice"
+        ).get_data()
+        assert mock_genai.return_value.generate_content.call_count == 1
+
+    assert body.count(b"event: chunk") == 1
+    assert b"Moonlight." in body
+
+
+# Test descriptions are regenerated after a prompt change or invalidation
+def test_piece_description_regenerated(app, client, monkeypatch):
+    replies = iter(["First.", "Second.", "Third."])
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_genai.return_value.generate_content.side_effect = (
+            lambda prompt: Mock(text=next(replies))
+        )
+        assert b"First." in client.get("/library/1?user_name=alice").data
+
+        monkeypatch.setattr(descriptions, "PROMPT_VERSION", 2)
+        assert b"Second." in client.get("/library/1?user_name=alice").data
+        assert b"Second." in client.get("/library/1?user_name=alice").data
+
+        result = app.test_cli_runner().invoke(
+            invalidate_descriptions, ["--piece-id", "1"]
+        )
+        assert "Invalidated 1 descriptions" in result.output
+        assert b"Third." in client.get("/library/1?user_name=alice").data
+
+
+# Test a failed generation isn't stored
+def test_failed_description_not_stored(app, client):
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_genai.return_value.generate_content.side_effect = Exception(
+            "quota"
+        )
+        response = client.get("/library/1?user_name=alice")
+
+    assert b"Unable to generate description" in response.data
+    with app.app_context():
+        assert db.session.get(PieceDescription, 1) is None
+
+
+# Test the pre-generation command fills in missing descriptions and can
+# be re-run to pick up pieces that failed
+def test_pregenerate_descriptions(app):
+    with app.app_context():
+        for n in range(2, 6):
+            db.session.add(
+                MusicPiece(
+                    composer="Frédéric Chopin",
+                    title=f"Nocturne No. {n}",
+                    genre="Keyboard",
+                    popular=False,
+                    recommended=False,
+                )
+            )
+        db.session.commit()
+
+    def generate(prompt):
+        if "Nocturne No. 3" in prompt:
+            raise Exception("quota")
+        return Mock(text=f"About {prompt.splitlines()[1]}")
+
+    runner = app.test_cli_runner()
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_genai.return_value.generate_content.side_effect = generate
+        result = runner.invoke(
+            pregenerate_descriptions, ["--workers", "2", "--rpm", "0"]
+        )
+        assert "4 generated, 1 failed" in result.output
+
+        mock_genai.return_value.generate_content.side_effect = None
+        mock_genai.return_value.generate_content.return_value = Mock(
+            text="Retried."
+        )
+        result = runner.invoke(pregenerate_descriptions, ["--rpm", "0"])
+        assert "1 generated, 0 failed" in result.output
+
+    with app.app_context():
+        assert PieceDescription.query.count() == 5
+        assert db.session.get(PieceDescription, 3).text == "Retried."
+        assert "Nocturne No. 4" in db.session.get(PieceDescription, 4).text
+
+
+# Test --rpm sets the pace of a pre-generation run instead of being capped
+# by the app's (here very tight) LLM_RPM limiter
+def test_pregenerate_descriptions_uses_own_rate(app):
+    with app.app_context():
+        for n in range(2, 6):
+            db.session.add(
+                MusicPiece(
+                    composer="Erik Satie",
+                    title=f"Gnossienne No. {n}",
+                    genre="Keyboard",
+                    popular=False,
+                    recommended=False,
+                )
+            )
+        db.session.commit()
+
+    llm = app.extensions["llm"]
+    llm.backend = StubBackend()
+    llm.limiter = TokenBucket(rate=0.01, capacity=1)
+    llm.queue_timeout = 0.1
+
+    result = app.test_cli_runner().invoke(
+        pregenerate_descriptions, ["--rpm", "6000"]
+    )
+    assert "5 generated, 0 failed" in result.output
+    assert llm.stats()["rate_limited"] == 0
+
+
+# Add Chopin nocturnes (odd numbers popular) to alice's library
+def add_nocturnes(app, count):
+    with app.app_context():
+        user = User.query.filter_by(username="alice").first()
+        for n in range(1, count + 1):
+            piece = MusicPiece(
+                composer="Frédéric Chopin",
+                title=f"Nocturne No. {n:02d}",
+                genre="Keyboard" if n % 3 else "Chamber",
+                popular=n % 2 == 1,
+                recommended=False,
+            )
+            db.session.add(piece)
+            db.session.flush()
+            db.session.add(
+                UserLibrary(user_id=user.id, music_piece_id=piece.id)
+            )
+        db.session.commit()
+
+
+# Test the library is served a page at a time with keyset cursors
+def test_library_pagination(app, client):
+    add_nocturnes(app, 7)
+    titles = []
+    url = "/library/?user_name=alice&sort=title&page_size=3"
+    while url:
+        response = client.get(url)
+        page = re.findall(rb'data-title="([^"]+)"', response.data)
+        assert len(page) <= 3
+        titles += page
+        match = re.search(rb'href="([^"]+)"[^>]*>Next page', response.data)
+        url = match and match.group(1).decode().replace("&amp;", "&")
+
+    assert len(titles) == 8
+    assert titles == sorted(titles)
+
+
+# Test the listing is filtered on the server
+def test_library_filters(app, client):
+    add_nocturnes(app, 6)
+    response = client.get(
+        "/library/?user_name=alice&composer=chopin&genre=Keyboard&popular=1"
+    )
+    titles = re.findall(rb'data-title="([^"]+)"', response.data)
+    assert titles == [b"Nocturne No. 01", b"Nocturne No. 05"]
+
+
+# Test a page of the library costs one query however big it is
+def test_library_listing_single_query(app, client):
+    add_nocturnes(app, 20)
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/library/?user_name=alice")
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert response.data.count(b'class="work-item"') == 21
+    assert len(statements) == 1
+
+
+# Test adding a piece creates the user, piece and entry in one commit and
+# that repeating it changes nothing
+def test_add_piece_single_transaction(app, client):
+    form = {
+        "user_name": "bob",
+        "composer_name": "Erik Satie",
+        "title": "Gymnopédie No. 1",
+        "genre": "Keyboard",
+        "popular": "true",
+        "recommended": "false",
+    }
+    commits = []
+
+    def count(conn):
+        commits.append(conn)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "commit", count)
+    try:
+        response = client.post("/library/add_piece", data=form)
+    finally:
+        event.remove(engine, "commit", count)
+
+    assert response.status_code == 302
+    assert "user_name=bob" in response.headers["Location"]
+    assert len(commits) == 1
+
+    client.post("/library/add_piece", data=form)
+    client.post("/library/add_piece", data={**form, "user_name": "alice"})
+    with app.app_context():
+        assert User.query.filter_by(username="bob").count() == 1
+        assert MusicPiece.query.filter_by(composer="Erik Satie").count() == 1
+        assert UserLibrary.query.count() == 3
+
+
+# Test a CSV upload is imported in batches and de-duplicated
+def test_import_library_csv(app, client):
+    rows = ["composer,title,subtitle,genre,popular,recommended"]
+    rows += [
+        f"Domenico Scarlatti,Sonata K. {n},,Keyboard,{n % 2},false"
+        for n in range(1, 1201)
+    ]
+    rows += [
+        "Domenico Scarlatti,Sonata K. 1,,Keyboard,1,false",
+        "Ludwig van Beethoven,Piano Sonata No. 14,Moonlight,Keyboard,1,1",
+        ",Untitled,,Keyboard,0,0",
+    ]
+    app.config["LIBRARY_IMPORT_CHUNK_SIZE"] = 500
+    response = client.post(
+        "/library/import",
+        data={
+            "user_name": "alice",
+            "file": (io.BytesIO("\n".join(rows).encode()), "scarlatti.csv"),
+        },
+    )
+
+    assert response.get_json() == {
+        "user_name": "alice",
+        "added": 1200,
+        "already_saved": 2,
+        "invalid": 1,
+    }
+    with app.app_context():
+        assert MusicPiece.query.count() == 1201
+        assert db.session.get(MusicPiece, 2).popular is True
+
+
+# Test the import command reads JSON rows given as objects or lists
+def test_import_library_command(app, tmp_path):
+    path = tmp_path / "library.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"composer": "Arvo Pärt", "title": "Spiegel im Spiegel"},
+                ["Arvo Pärt", "Für Alina", "", "Keyboard", True, False],
+            ]
+        )
+    )
+    result = app.test_cli_runner().invoke(import_library, ["carol", str(path)])
+
+    assert "Imported 2 pieces for carol" in result.output
+    with app.app_context():
+        user = User.query.filter_by(username="carol").one()
+        assert UserLibrary.query.filter_by(user_id=user.id).count() == 2
+
+
+# Test an unreadable upload is rejected
+def test_import_library_bad_file(client):
+    response = client.post(
+        "/library/import",
+        data={
+            "user_name": "alice",
+            "file": (io.BytesIO(b"{not json"), "library.json"),
+        },
+    )
+    assert response.status_code == 400
+
+
+# Test several selected works are saved with one JSON request
+def test_add_pieces_batch(app, client):
+    pieces = [
+        {
+            "composer": "Claude Debussy",
+            "title": f"Prélude No. {n}",
+            "subtitle": "",
+            "genre": "Keyboard",
+            "popular": n == 1,
+            "recommended": False,
+        }
+        for n in range(1, 31)
+    ]
+    response = client.post(
+        "/library/add_pieces", json={"user_name": "alice", "pieces": pieces}
+    )
+    assert response.get_json() == {
+        "user_name": "alice",
+        "added": 30,
+        "already_saved": 0,
+        "invalid": 0,
+    }
+
+    again = client.post(
+        "/library/add_pieces",
+        json={"user_name": "alice", "pieces": pieces[:2]},
+    )
+    assert again.get_json()["already_saved"] == 2
+
+    missing = client.post("/library/add_pieces", json={"pieces": pieces})
+    assert missing.status_code == 400
+    not_a_name = client.post(
+        "/library/add_pieces", json={"user_name": ["a"], "pieces": []}
+    )
+    assert not_a_name.status_code == 400
+    with app.app_context():
+        assert UserLibrary.query.count() == 31
+
+
+# Test deleting from a library only removes a piece nobody else has
+def test_delete_piece_removes_only_orphan(app, client):
+    with app.app_context():
+        bob = User(username="bob")
+        db.session.add(bob)
+        db.session.flush()
+        db.session.add(UserLibrary(user_id=bob.id, music_piece_id=1))
+        db.session.add(
+            PieceDescription(
+                music_piece_id=1,
+                text="Stored.",
+                model="stub:gemini-pro",
+                prompt_version=1,
+                created_at=datetime(2024, 1, 1),
+            )
+        )
+        db.session.commit()
+
+    delete = {"submit_button": "delete"}
+    client.post("/library/1", data={**delete, "user_name": "alice"})
+    with app.app_context():
+        assert db.session.get(MusicPiece, 1) is not None
+
+    response = client.post("/library/1", data={**delete, "user_name": "bob"})
+    assert response.status_code == 302
+    with app.app_context():
+        assert db.session.get(MusicPiece, 1) is None
+        assert db.session.get(PieceDescription, 1) is None
+
+
+# Test the batched GC command sweeps up unreferenced pieces
+def test_gc_orphaned_pieces(app):
+    with app.app_context():
+        for n in range(5):
+            db.session.add(
+                MusicPiece(
+                    composer="Anonymous",
+                    title=f"Estampie {n}",
+                    genre="Chamber",
+                    popular=False,
+                    recommended=False,
+                )
+            )
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(
+        gc_orphaned_pieces, ["--batch-size", "2"]
+    )
+    assert "5 pieces deleted" in result.output
+    with app.app_context():
+        assert [piece.id for piece in MusicPiece.query] == [1]
+
+
+# Test concurrent first views of a piece all get the description
+def test_concurrent_first_views_store_one_description(app):
+    app.extensions["llm"].backend = StubBackend(latency=0.1)
+    for _ in range(5):
+        with app.app_context():
+            descriptions.invalidate_descriptions()
+
+        statuses = []
+
+        def view():
+            response = app.test_client().get("/library/1?user_name=alice")
+            statuses.append((response.status_code, b"stub" in response.data))
+
+        threads = [threading.Thread(target=view) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert statuses == [(200, True)] * 4
+        with app.app_context():
+            assert PieceDescription.query.count() == 1
+
+
+# Test concurrent describe_piece calls share one LLM call (the gateway
+# coalesces them) and every caller's save of the result succeeds
+def test_concurrent_describe_piece_coalesces(app):
+    backend = StubBackend(latency=0.2)
+    backend.generate = Mock(wraps=backend.generate)
+    app.extensions["llm"].backend = backend
+    start = threading.Barrier(6)
+    results, errors = [], []
+
+    def describe():
+        with app.app_context():
+            piece = db.session.get(MusicPiece, 1)
+            start.wait()
+            try:
+                results.append(descriptions.describe_piece(piece))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=describe) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(results) == 6 and len(set(results)) == 1
+    assert backend.generate.call_count == 1
+    with app.app_context():
+        assert PieceDescription.query.count() == 1
+        assert app.extensions["llm"].stats()["coalesced"] == 5
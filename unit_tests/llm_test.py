@@ -0,0 +1,199 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import time
+import pytest
+from unittest.mock import Mock, patch
+from app import create_app
+from services.llm import (
+    GeminiBackend,
+    LLMError,
+    LLMGateway,
+    LLMRateLimited,
+    LLMTimeout,
+    StubBackend,
+    TokenBucket,
+    create_gateway,
+)
+
+
+# Test the stub backend is deterministic per prompt
+def test_stub_backend_is_deterministic():
+    llm = LLMGateway(StubBackend(), model_name="gemini-pro")
+    first = llm.generate("Describe the Moonlight Sonata")
+    assert llm.generate("Describe the Moonlight Sonata") == first
+    assert llm.generate("Describe the Goldberg Variations") != first
+    assert "".join(llm.stream("Describe the Moonlight Sonata")) == first
+
+
+# Test calls and token counts are recorded
+def test_gateway_stats():
+    llm = LLMGateway(StubBackend(), model_name="gemini-pro")
+    llm.generate("one two three four")
+    list(llm.stream("five six seven eight"))
+
+    stats = llm.stats()
+    assert stats["backend"] == "stub"
+    assert stats["calls"] == 2
+    assert stats["errors"] == 0
+    assert stats["prompt_tokens"] > 0
+    assert stats["output_tokens"] > 0
+
+
+# Test a slow call is abandoned after the timeout
+def test_gateway_timeout():
+    release = threading.Event()
+    backend = Mock(name="backend")
+    backend.generate.side_effect = lambda model, prompt: release.wait(5)
+    llm = LLMGateway(backend, model_name="gemini-pro", timeout=0.1)
+    try:
+        with pytest.raises(LLMTimeout):
+            llm.generate("slow")
+    finally:
+        release.set()
+    assert llm.stats()["timeouts"] == 1
+
+
+# Test the Gemini backend builds each model once and reuses it
+def test_gemini_backend_reuses_model():
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_genai.return_value.generate_content.return_value = Mock(
+            text="Nocturne", usage_metadata=None
+        )
+        llm = LLMGateway(GeminiBackend(api_key="key"), model_name="gemini-pro")
+        assert llm.generate("a") == "Nocturne"
+        assert llm.generate("b") == "Nocturne"
+
+    assert mock_genai.call_count == 1
+
+
+# Test a missing API key surfaces as an error instead of a call
+def test_gemini_backend_without_key():
+    llm = LLMGateway(GeminiBackend(api_key=None), model_name="gemini-pro")
+    with pytest.raises(LLMError):
+        llm.generate("a")
+    assert llm.stats()["errors"] == 1
+
+
+# Test the stub backend can serve the app offline
+def test_app_with_stub_backend():
+    app = create_app(testing=True)
+    app.extensions["llm"].backend = StubBackend()
+    with app.app_context():
+        from database import db
+        from models.musicpiece import MusicPiece
+        from models.user import User
+        from models.userlibrary import UserLibrary
+
+        user = User(username="bob")
+        piece = MusicPiece(
+            composer="Bach",
+            title="Goldberg Variations",
+            genre="Keyboard",
+            popular=True,
+            recommended=True,
+        )
+        db.session.add_all([user, piece])
+        db.session.flush()
+        db.session.add(UserLibrary(user_id=user.id, music_piece_id=piece.id))
+        db.session.commit()
+
+    response = app.test_client().get("/library/1?user_name=bob")
+    assert b"stub" in response.data
+    assert app.test_client().get("/stats").get_json()["llm"]["calls"] == 1
+
+
+# Test the gateway builds the backend named by LLM_BACKEND
+def test_create_gateway_backends():
+    config = dict(create_app(testing=True).config)
+    config.update(LLM_BACKEND="stub", LLM_STUB_LATENCY=0.5)
+    backend = create_gateway(config).backend
+    assert isinstance(backend, StubBackend) and backend.latency == 0.5
+
+    config["LLM_BACKEND"] = "gemini"
+    backend = create_gateway(config).backend
+    assert isinstance(backend, GeminiBackend)
+    assert backend.api_key == config["GOOGLE_API_KEY"]
+
+    config["LLM_BACKEND"] = "other"
+    with pytest.raises(ValueError):
+        create_gateway(config)
+
+
+# Test the bucket allows a burst, then refills at its rate
+def test_token_bucket():
+    bucket = TokenBucket(rate=20, capacity=2)
+    assert bucket.acquire(0)
+    assert bucket.acquire(0)
+    assert not bucket.acquire(0.01)
+
+    started = time.monotonic()
+    assert bucket.acquire(1)
+    assert 0.02 < time.monotonic() - started < 0.5
+
+
+# Test a call that can't get a rate limit slot in time fails cleanly
+def test_gateway_rate_limited():
+    llm = LLMGateway(
+        StubBackend(),
+        model_name="gemini-pro",
+        limiter=TokenBucket(rate=0.1, capacity=1),
+        queue_timeout=0.1,
+    )
+    llm.generate("first")
+    with pytest.raises(LLMRateLimited):
+        llm.generate("second")
+    assert llm.stats()["rate_limited"] == 1
+
+
+# Test concurrent identical prompts share one backend call
+def test_gateway_coalesces_identical_prompts():
+    backend = StubBackend(latency=0.2)
+    backend.generate = Mock(wraps=backend.generate)
+    llm = LLMGateway(backend, model_name="gemini-pro")
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(llm.generate("same")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(results)) == 1 and len(results) == 5
+    assert backend.generate.call_count == 1
+    assert llm.stats()["coalesced"] == 4
+
+    # Once finished, the same prompt is sent again
+    llm.generate("same")
+    assert backend.generate.call_count == 2
+
+
+# Test jobs submitted under the same key share one run
+def test_submit_once_shares_running_job():
+    app = create_app(testing=True)
+    jobs = app.extensions["jobs"]
+    release = threading.Event()
+
+    first = jobs.submit_once("key", lambda job: release.wait(5))
+    assert jobs.submit_once("key", lambda job: None) is first
+    release.set()
+    first.wait(timeout=5)
+    assert jobs.submit_once("key", lambda job: None) is not first
+
+
+# Test a TimeoutError raised by the backend isn't reported as the
+# gateway's own timeout
+def test_gateway_passes_backend_timeout_through():
+    backend = Mock(name="backend")
+    backend.generate.side_effect = TimeoutError("socket read timed out")
+    llm = LLMGateway(backend, model_name="gemini-pro", timeout=5)
+    with pytest.raises(TimeoutError) as raised:
+        llm.generate("prompt")
+    assert not isinstance(raised.value, LLMTimeout)
+    assert llm.stats()["errors"] == 1
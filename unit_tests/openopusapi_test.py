@@ -5,7 +5,13 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import pytest
 import requests_mock
+from datetime import datetime
 from app import create_app
+from database import db
+from models.composer import Composer
+from models.work import Work
+from services import fulltext
+from services.catalog import composer_names, parse_composer_ids, sync_catalog
 
 
 # Create test Flask app instance with in-memory SQLite database
@@ -21,67 +27,220 @@ def client(app):
     return app.test_client()
 
 
-# Test form route with successful composer fetch
-def test_form_route_composers_success(client):
+# Add a synced composer and their works to the local catalog
+def add_composer(app, composer_id, name, works):
+    with app.app_context():
+        db.session.add(
+            Composer(
+                id=composer_id,
+                name=name,
+                complete_name=name,
+                epoch="Classical",
+                works_synced_at=datetime(2024, 1, 1),
+            )
+        )
+        db.session.add_all(
+            Work(composer_id=composer_id, **work) for work in works
+        )
+        db.session.commit()
+
+
+# Test the form no longer inlines the composer list
+def test_form_route_composers_success(app, client):
+    add_composer(app, 1, "Mozart", [])
+    response = client.get("/form")
+    assert response.status_code == 200
+    assert b"composer_search" in response.data
+    assert b"Mozart" not in response.data
+
+    response = client.get("/api/composers?q=moz")
+    assert response.get_json()["composers"][0]["epoch"] == "Classical"
+
+
+# Test the form route with an empty catalog
+def test_form_route_composers_empty(client):
+    response = client.get("/form")
+    assert response.status_code == 200
+    assert b"No composers available" in response.data
+
+
+# Test search reads works from the local catalog
+def test_search_works_integration(app, client):
+    add_composer(
+        app,
+        1,
+        "Wolfgang Amadeus Mozart",
+        [
+            {
+                "title": "Symphony No. 40",
+                "genre": "Orchestral",
+                "subtitle": "Great",
+                "popular": True,
+                "recommended": True,
+            },
+            {"title": "Don Giovanni", "genre": "Opera"},
+        ],
+    )
+
+    form_data = {
+        "composer_id": ["1"],
+        "name": "Mozart",
+        "genres": ["Orchestral"],
+    }
+    response = client.post("/search", data=form_data)
+    assert response.status_code == 200
+    # Check for the presence of the work details
+    assert b"Symphony No. 40" in response.data
+    assert b"Mozart" in response.data
+    assert b"Orchestral" in response.data
+    assert b"select-work" in response.data
+    assert b"Don Giovanni" not in response.data
+
+
+# Test search keeps composer order and skips unsynced composers
+def test_search_keeps_composer_order(app, client):
+    add_composer(
+        app, 1, "Mozart", [{"title": "Mozart Work", "genre": "Opera"}]
+    )
+    add_composer(app, 2, "Bach", [{"title": "Bach Work", "genre": "Opera"}])
+
+    form_data = {
+        "composer_id": ["2", "3", "1"],
+        "name": "Tester",
+        "genres": ["Opera"],
+    }
+    response = client.post("/search", data=form_data)
+    assert response.status_code == 200
+    assert response.data.index(b"Bach Work") < response.data.index(
+        b"Mozart Work"
+    )
+
+
+# Test search shows the no results page for unknown composers
+def test_search_unknown_composers(client):
+    response = client.post(
+        "/search",
+        data={"composer_id": ["1"], "name": "Tester", "genres": ["Opera"]},
+    )
+    assert response.status_code == 200
+    assert b"No Results" in response.data
+
+
+# Test catalog sync only refreshes composers that failed or are new
+def test_sync_catalog_is_resumable(app):
     with requests_mock.Mocker() as mock:
         mock.get(
             "https://api.openopus.org/composer/list/name/all.json",
             json={
                 "composers": [
-                    {"id": 1, "name": "Mozart", "epoch": "Classical"}
+                    {
+                        "id": "1",
+                        "name": "Mozart",
+                        "complete_name": "W. Mozart",
+                    },
+                    {"id": "2", "name": "Bach", "complete_name": "J.S. Bach"},
                 ]
             },
         )
-        response = client.get("/form")
-        assert response.status_code == 200
-        assert b"Mozart" in response.data
-        assert b"Classical" in response.data
-
-
-# Test the form route with failed composer fetch
-def test_form_route_composers_failure(client):
-    with requests_mock.Mocker() as mock:
+        works_1 = mock.get(
+            "https://api.openopus.org/work/list/composer/1/genre/all.json",
+            json={"works": [{"title": "Requiem", "genre": "Choral"}]},
+        )
         mock.get(
-            "https://api.openopus.org/composer/list/name/all.json",
+            "https://api.openopus.org/work/list/composer/2/genre/all.json",
             status_code=500,
         )
-        response = client.get("/form")
-        assert response.status_code == 200
-        assert b"Failed to fetch composers" in response.data
 
+        with app.app_context():
+            assert sync_catalog(echo=lambda message: None) == (1, 1)
+
+            mock.get(
+                "https://api.openopus.org/work/list/composer/2/genre/all.json",
+                json={
+                    "works": [{"title": "Mass in B minor", "genre": "Choral"}]
+                },
+            )
+            assert sync_catalog(echo=lambda message: None) == (1, 0)
+            assert works_1.call_count == 1
+            assert Work.query.count() == 2
+
+            # Synced works are searchable straight away
+            total, results = fulltext.search("mass")
+            assert total == 1
+            assert results[0]["composer_name"] == "J.S. Bach"
+
+
+# Test composer names are resolved in bulk, skipping unsynced composers
+def test_composer_names_bulk_lookup(app):
+    add_composer(app, 1, "Mozart", [])
+    add_composer(app, 2, "Bach", [])
+    with app.app_context():
+        db.session.add(Composer(id=3, name="Haydn", complete_name="Haydn"))
+        db.session.commit()
+
+        composer_ids = parse_composer_ids(["2", "x", "3", "1"])
+        assert composer_ids == [2, 3, 1]
+        assert parse_composer_ids(["0", "-4", str(2**63), "5"]) == [5]
+        assert composer_names(composer_ids) == {1: "Mozart", 2: "Bach"}
+
+
+# Test search serves results one page at a time
+def test_search_pagination(app, client):
+    add_composer(
+        app,
+        1,
+        "Mozart",
+        [{"title": f"Sonata No. {n}", "genre": "Keyboard"} for n in range(5)],
+    )
+    form_data = {
+        "composer_id": ["1"],
+        "name": "Tester",
+        "genres": ["Keyboard"],
+        "page_size": "2",
+        "cursor": "2",
+    }
+    response = client.post("/search", data=form_data)
+    assert response.status_code == 200
+    assert b"Sonata No. 2" in response.data
+    assert b"Sonata No. 3" in response.data
+    assert b"Sonata No. 1<" not in response.data
+    assert b"Sonata No. 4" not in response.data
+    assert b'name="cursor" value="4"' in response.data
+
+
+# Test a cursor past the last result shows the last page
+def test_search_cursor_past_end(app, client):
+    add_composer(
+        app,
+        1,
+        "Mozart",
+        [{"title": f"Sonata No. {n}", "genre": "Keyboard"} for n in range(5)],
+    )
+    form_data = {
+        "composer_id": ["1"],
+        "name": "Tester",
+        "genres": ["Keyboard"],
+        "page_size": "2",
+        "cursor": "5",
+    }
+    response = client.post("/search", data=form_data)
+    assert response.status_code == 200
+    assert b"Sonata No. 4" in response.data
+    assert "Showing 5–5 of 5 works" in response.get_data(as_text=True)
+    assert b'name="cursor"' not in response.data
 
-# Test search functionality with mocked API responses
-def test_search_works_integration(client):
-    with requests_mock.Mocker() as mock:
-        # Mock composer details endpoint
-        mock.get(
-            "https://api.openopus.org/composer/list/ids/1.json",
-            json={"composers": [{"complete_name": "Wolfgang Amadeus Mozart"}]},
-        )
-        # Mock works endpoint
-        mock.get(
-            "https://api.openopus.org/work/list/composer/1/genre/all.json",
-            json={
-                "works": [
-                    {
-                        "title": "Symphony No. 40",
-                        "genre": "Orchestral",
-                        "subtitle": "Great",
-                        "popular": "1",
-                        "recommended": "1",
-                    }
-                ]
-            },
-        )
 
-        form_data = {
-            "composer_id": ["1"],
-            "name": "Mozart",
-            "genres": ["Orchestral"],
-        }
-        response = client.post("/search", data=form_data)
-        assert response.status_code == 200
-        # Check for the presence of the work details
-        assert b"Symphony No. 40" in response.data
-        assert b"Mozart" in response.data
-        assert b"Orchestral" in response.data
+# Test streamed mode sends rows for every composer
+def test_search_streamed(app, client):
+    add_composer(app, 1, "Mozart", [{"title": "Requiem", "genre": "Choral"}])
+    add_composer(app, 2, "Bach", [{"title": "Mass", "genre": "Choral"}])
+    form_data = {
+        "composer_id": ["2", "1"],
+        "name": "Tester",
+        "genres": ["Choral"],
+        "stream": "1",
+    }
+    response = client.post("/search", data=form_data)
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.data.index(b"Mass") < response.data.index(b"Requiem")
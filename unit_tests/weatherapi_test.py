@@ -3,6 +3,9 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import re
+import threading
+import time
 import pytest
 import requests_mock
 from unittest.mock import Mock, patch
@@ -20,6 +23,14 @@ def client(app):
     return app.test_client()
 
 
+# Wait for the page's background suggestion job and return its status
+def wait_for_suggestion(client, response):
+    job_id = re.search(rb'data-job="(\w+)"', response.data).group(1)
+    job = client.application.extensions["jobs"].get(job_id.decode())
+    job.wait(timeout=5)
+    return client.get(f"/weather-mood/suggestion/{job.id}").get_json()
+
+
 def test_weather_mood_integration(client):
     with requests_mock.Mocker() as mock:
         # Mock weather API with complete response structure
@@ -70,3 +81,296 @@ def test_weather_api_failure(client):
         assert response.status_code == 200
         # Verify template renders with no weather data
         assert b"weather-mood" in response.data.lower()
+
+
+def test_weather_mood_uses_cache(client):
+    with requests_mock.Mocker() as mock:
+        weather = mock.get(
+            "http://api.weatherapi.com/v1/current.json?key=test_key&q=London&aqi=no",
+            json={
+                "location": {"name": "London"},
+                "current": {"condition": {"text": "Rain"}, "temp_c": 8},
+            },
+        )
+        mock.get(
+            "https://api.openopus.org/composer/list/pop.json",
+            json={"composers": [{"complete_name": "Mozart"}]},
+        )
+
+        with patch("google.generativeai.GenerativeModel") as mock_genai:
+            mock_genai.return_value.generate_content.return_value.text = "Hi"
+            client.get("/weather-mood")
+            client.get("/weather-mood")
+
+        assert weather.call_count == 1
+        stats = client.get("/stats").get_json()
+        assert stats["api_cache"]["hits"] == 2
+
+
+def test_weather_mood_reuses_cached_suggestion(app, client):
+    app.config["SUGGESTION_VARIANTS_PER_KEY"] = 1
+    with requests_mock.Mocker() as mock:
+        weather = mock.get(
+            "http://api.weatherapi.com/v1/current.json?key=test_key&q=London&aqi=no",
+            json={
+                "location": {"name": "London"},
+                "current": {"condition": {"text": "Light rain"}, "temp_c": 11},
+            },
+        )
+        mock.get(
+            "https://api.openopus.org/composer/list/pop.json",
+            json={"composers": [{"complete_name": "Chopin"}]},
+        )
+
+        with patch("google.generativeai.GenerativeModel") as mock_genai:
+            generate = mock_genai.return_value.generate_content
+            generate.return_value.text = "Chopin's Raindrop Prelude"
+            first = client.get("/weather-mood")
+            first_job = wait_for_suggestion(client, first)
+
+            # Same condition and temperature bucket after a weather refresh
+            client.application.extensions["api_cache"].clear()
+            mock.get(
+                "http://api.weatherapi.com/v1/current.json?key=test_key&q=London&aqi=no",
+                json={
+                    "location": {"name": "London"},
+                    "current": {
+                        "condition": {"text": "Light  Rain"},
+                        "temp_c": 13,
+                    },
+                },
+            )
+            second = client.get("/weather-mood")
+
+        assert generate.call_count == 1
+        assert first_job["result"] == "Chopin's Raindrop Prelude"
+        assert b"Raindrop Prelude" in second.data
+        assert b"13" in second.data
+
+
+# Number of weather suggestions in the database
+def stored_suggestions(app):
+    from models.suggestion import WeatherSuggestion
+
+    with app.app_context():
+        return WeatherSuggestion.query.count()
+
+
+# Test a key with fewer than SUGGESTION_VARIANTS_PER_KEY fresh suggestions
+# gets another generated in the background, and one with a full set doesn't
+def test_weather_mood_tops_up_suggestion_variants(app, client):
+    app.config["SUGGESTION_VARIANTS_PER_KEY"] = 2
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "http://api.weatherapi.com/v1/current.json?key=test_key&q=London&aqi=no",
+            json={
+                "location": {"name": "London"},
+                "current": {"condition": {"text": "Hail"}, "temp_c": 2},
+            },
+        )
+        mock.get(
+            "https://api.openopus.org/composer/list/pop.json",
+            json={"composers": [{"complete_name": "Holst"}]},
+        )
+
+        with patch("google.generativeai.GenerativeModel") as mock_genai:
+            replies = iter(["Mars", "Saturn", "Jupiter"])
+            generate = mock_genai.return_value.generate_content
+            generate.side_effect = lambda prompt: Mock(text=next(replies))
+
+            first = client.get("/weather-mood")
+            assert wait_for_suggestion(client, first)["result"] == "Mars"
+
+            # A cached suggestion is shown straight away while a second
+            # variant is generated behind it
+            second = client.get("/weather-mood")
+            assert b"Mars" in second.data
+            assert b"data-job" not in second.data
+            deadline = time.monotonic() + 5
+            while stored_suggestions(app) < 2 and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+            third = client.get("/weather-mood")
+
+    assert generate.call_count == 2
+    assert stored_suggestions(app) == 2
+    assert b"Mars" in third.data or b"Saturn" in third.data
+
+
+def test_weather_mood_fetches_concurrently_under_deadline(app, client):
+    app.config["WEATHER_MOOD_DEADLINE"] = 1.5
+    release = threading.Event()
+
+    # Block in front of the mock: requests_mock serialises requests, so a
+    # slow response callback would hold up the weather fetch too
+    cache = app.extensions["api_cache"]
+    fetch = cache.fetch
+
+    def slow_fetch(url):
+        if "openopus" in url:
+            release.wait(timeout=10)
+            return {"composers": [{"complete_name": "Mozart"}]}
+        return fetch(url)
+
+    cache.fetch = slow_fetch
+
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "http://api.weatherapi.com/v1/current.json?key=test_key&q=London&aqi=no",
+            json={
+                "location": {"name": "London"},
+                "current": {"condition": {"text": "Fog"}, "temp_c": 4},
+            },
+        )
+
+        with patch("google.generativeai.GenerativeModel") as mock_genai:
+            mock_genai.return_value.generate_content.return_value.text = "Hi"
+            started = time.monotonic()
+            response = client.get("/weather-mood")
+            elapsed = time.monotonic() - started
+            release.set()
+
+    # The slow composer list is dropped; the weather still renders
+    assert elapsed < 5
+    assert b"Fog" in response.data
+
+
+def test_weather_mood_renders_before_suggestion(client):
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "http://api.weatherapi.com/v1/current.json?key=test_key&q=London&aqi=no",
+            json={
+                "location": {"name": "London"},
+                "current": {"condition": {"text": "Snow"}, "temp_c": -1},
+            },
+        )
+        mock.get(
+            "https://api.openopus.org/composer/list/pop.json",
+            json={"composers": [{"complete_name": "Vivaldi"}]},
+        )
+
+        release = Mock()
+        with patch("google.generativeai.GenerativeModel") as mock_genai:
+            started = time.monotonic()
+
+            def slow_generate(prompt):
+                time.sleep(1)
+                release.text = "Vivaldi's Winter"
+                return release
+
+            mock_genai.return_value.generate_content.side_effect = (
+                slow_generate
+            )
+            response = client.get("/weather-mood")
+
+            # The page comes back before the LLM call finishes
+            assert time.monotonic() - started < 1
+            assert b"Snow" in response.data
+            assert b"Composing a suggestion" in response.data
+
+            # By default the page polls the status endpoint
+            assert b'data-sse="false"' in response.data
+            job = wait_for_suggestion(client, response)
+            assert job["status"] == "done"
+            assert job["result"] == "Vivaldi's Winter"
+            events = client.get(f"/weather-mood/suggestion/{job['id']}/events")
+            assert events.status_code == 404
+
+
+def test_weather_mood_unknown_suggestion_job(client):
+    response = client.get("/weather-mood/suggestion/missing")
+    assert response.status_code == 404
+
+
+def test_weather_mood_streams_suggestion_chunks(app, client):
+    app.config["LLM_STREAMING"] = True
+    app.config["SUGGESTION_SSE"] = True
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "http://api.weatherapi.com/v1/current.json?key=test_key&q=London&aqi=no",
+            json={
+                "location": {"name": "London"},
+                "current": {"condition": {"text": "Windy"}, "temp_c": 9},
+            },
+        )
+        mock.get(
+            "https://api.openopus.org/composer/list/pop.json",
+            json={"composers": [{"complete_name": "Wagner"}]},
+        )
+
+        with patch("google.generativeai.GenerativeModel") as mock_genai:
+            mock_genai.return_value.generate_content.return_value = [
+                Mock(text="Ride of "),
+                Mock(text="the Valkyries"),
+            ]
+            response = client.get("/weather-mood")
+            job_id = re.search(rb'data-job="(\w+)"', response.data).group(1)
+            events = client.get(
+                f"/weather-mood/suggestion/{job_id.decode()}/events"
+            ).get_data()
+
+    assert b"event: chunk" in events
+    assert b"event: done" in events
+    assert b"Ride of the Valkyries" in events
+
+
+# Test an SSE connection is closed after JOB_EVENTS_TIMEOUT even while the
+# job is still running, leaving the page to poll
+def test_suggestion_events_are_time_limited(app, client):
+    app.config["SUGGESTION_SSE"] = True
+    app.config["JOB_EVENTS_TIMEOUT"] = 0.2
+    release = threading.Event()
+    job = app.extensions["jobs"].submit(lambda job: release.wait(5))
+    try:
+        started = time.monotonic()
+        events = client.get(f"/weather-mood/suggestion/{job.id}/events")
+        events = events.get_data()
+        elapsed = time.monotonic() - started
+    finally:
+        release.set()
+
+    assert elapsed < 2
+    assert b"event: running" in events
+
+
+def test_normalise_location():
+    from services.weather import normalise_location
+
+    assert normalise_location("  New   York ") == "new york"
+    assert normalise_location("NEW YORK") == "new york"
+    assert normalise_location("51.5074, -0.1278") == "51.5,-0.1"
+    assert normalise_location("51.52,-0.13") == "51.5,-0.1"
+    assert normalise_location("Paris, France") == "paris, france"
+    assert normalise_location("") is None
+    assert normalise_location(None) is None
+
+
+def test_weather_mood_uses_requested_location(client):
+    with requests_mock.Mocker() as mock:
+        weather = mock.get(
+            "http://api.weatherapi.com/v1/current.json?key=test_key&q=paris&aqi=no",
+            json={
+                "location": {"name": "Paris"},
+                "current": {"condition": {"text": "Cloudy"}, "temp_c": 14},
+            },
+        )
+        mock.get(
+            "https://api.openopus.org/composer/list/pop.json",
+            json={"composers": [{"complete_name": "Debussy"}]},
+        )
+
+        with patch("google.generativeai.GenerativeModel") as mock_genai:
+            mock_genai.return_value.generate_content.return_value.text = (
+                "Clair de Lune"
+            )
+            response = client.get("/weather-mood?location=%20PARIS%20")
+            assert b"Paris" in response.data
+            wait_for_suggestion(client, response)
+            prompt = mock_genai.return_value.generate_content.call_args[0][0]
+            assert "in Paris today" in prompt
+
+            # The location is remembered, and "Paris" shares the cache entry
+            client.get("/weather-mood")
+            client.get("/weather-mood?location=Paris")
+
+    assert weather.call_count == 1
@@ -0,0 +1,97 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from datetime import datetime
+from app import create_app
+from database import db
+from models.composer import Composer
+from models.work import Work
+from services.work_index import WorkIndex, WorkRecord
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    with test_app.app_context():
+        for composer_id, name in [(1, "Mozart"), (2, "Bach")]:
+            db.session.add(
+                Composer(
+                    id=composer_id,
+                    name=name,
+                    complete_name=name,
+                    works_synced_at=datetime(2024, 1, 1),
+                )
+            )
+        db.session.add_all(
+            [
+                Work(composer_id=1, title="Requiem", genre="Choral"),
+                Work(
+                    composer_id=1,
+                    title="Symphony No. 40",
+                    genre="Orchestral",
+                    popular=True,
+                ),
+                Work(composer_id=2, title="Mass in B minor", genre="Choral"),
+            ]
+        )
+        db.session.commit()
+    return test_app
+
+
+# Test lookups group works per composer in the requested order
+def test_index_lookup(app):
+    with app.app_context():
+        index = WorkIndex()
+        results = index.lookup([2, 3, 1], ["Choral", "Orchestral"])
+
+        assert [name for _, name, _ in results] == ["Bach", "Mozart"]
+        titles = [work["title"] for work in results[1][2]]
+        assert titles == ["Requiem", "Symphony No. 40"]
+        assert results[1][2][1].popular is True
+        assert results[1][2][1].get("recommended") is False
+
+        index.lookup([1], ["Choral"])
+        assert index.stats()["hits"] == 1
+
+
+# Test records are compact and share interned strings
+def test_work_record_is_compact():
+    first = WorkRecord(
+        "".join(["Req", "uiem"]), "", "Choral", "Mozart", "1", 0
+    )
+    second = WorkRecord("Requiem", "", "Choral", "Mozart", "1", 0)
+    assert not hasattr(first, "__dict__")
+    assert first.title is second.title
+
+
+# Test the memory budget evicts the least recently used composer
+def test_index_memory_budget(app):
+    with app.app_context():
+        index = WorkIndex(max_bytes=1)
+        index.lookup([1], ["Choral"])
+        index.lookup([2], ["Choral"])
+
+        stats = index.stats()
+        assert stats["composers"] == 1
+        assert stats["evictions"] == 1
+
+
+# Test the index drops itself when the catalog changes or on reload
+def test_index_reload(app):
+    with app.app_context():
+        index = WorkIndex(refresh_interval=0)
+        index.lookup([1], ["Choral"])
+
+        db.session.add(Work(composer_id=1, title="Ave verum", genre="Choral"))
+        db.session.get(Composer, 1).works_synced_at = datetime(2024, 2, 1)
+        db.session.commit()
+
+        results = index.lookup([1], ["Choral"])
+        assert len(results[0][2]) == 2
+        assert index.stats()["reloads"] == 1
+
+        index.reload()
+        assert index.stats()["composers"] == 0